@@ -0,0 +1,92 @@
+''' This file is part of the SL API package and holds the
+    single-flight layer used to coalesce identical reads.
+
+    When several threads ask SoftLayer for the same thing at the
+    same time (the same account guest list, the same user by sluid)
+    only the first caller actually sends the request.  The others
+    wait on it and share its result, or its exception.
+
+    /* Example:
+    import coalesce
+    key = coalesce.make_key('SoftLayer_Account', 'getVirtualGuests')
+    guests = coalesce.flight.do(key, client['SoftLayer_Account'].getVirtualGuests)
+    */ '''
+
+import json
+import threading
+
+
+def make_key(service, method, id=None, mask=None, filter=None, account=None):
+    ''' Build the coalescing key for a read.  Masks and filters
+        may be dicts so we serialize them in a stable order.  The
+        account name keeps reads against different accounts apart. '''
+
+    if isinstance(mask, dict):
+        mask = json.dumps(mask, sort_keys=True)
+    if isinstance(filter, dict):
+        filter = json.dumps(filter, sort_keys=True)
+
+    return (account, service, method, id, mask, filter)
+
+
+class _Call(object):
+    ''' One in-flight request and the waiters hanging off it '''
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    ''' Share one in-flight request between concurrent callers
+        asking for the same key.  Nothing is cached once the
+        request returns; the next caller goes back to the API. '''
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.calls = {}
+
+
+    def do(self, key, fn, *args, **kwargs):
+        ''' Run fn(*args, **kwargs) unless an identical call is
+            already running, in which case wait for that one. '''
+
+        self.lock.acquire()
+        try:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+        finally:
+            self.lock.release()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return(call.result)
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self.lock.acquire()
+            try:
+                del self.calls[key]
+            finally:
+                self.lock.release()
+            call.event.set()
+
+        return(call.result)
+
+
+# Shared by vm_controls and users so lookups from both coalesce
+flight = SingleFlight()
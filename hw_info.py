@@ -0,0 +1,85 @@
+''' This file is part of the SL API package and holds the hardware
+    inventory used by users.py when granting or removing device
+    access.
+
+    Device access calls only need hardware ids, so we ask for
+    mask[id] a page at a time and keep the resulting id set for a
+    TTL.  Each account (see accounts.py) holds one HardwareInventory
+    shared by every UserManager on it, so a bulk user run downloads
+    the list once.
+
+    Uses the SoftLayer Rest API like users.py.
+
+    /* Example:
+    hardware = accounts.default().hardware
+    hwIds = hardware.ids()          # cached for hardware.ttl seconds
+    hardware.invalidate()           # force the next call to refetch
+    */ '''
+
+import time
+import threading
+import accounts
+
+
+class GetHardware(object):
+    ''' Raw hardware listing, one request with an id-only mask.
+        Kept for callers that want the Response itself. '''
+
+    def __init__(self, account=None):
+
+        self.account = accounts.resolve(account)
+
+
+    def get_hardware(self):
+
+        return self.account.session.get(
+            self.account.url('SoftLayer_Account/getHardware.json?objectMask=mask[id]'))
+
+
+class HardwareInventory(object):
+    ''' Cached, paged set of every hardware id on an account '''
+
+    def __init__(self, account=None, ttl=300, pageSize=500):
+
+        self.account = accounts.resolve(account)
+        self.ttl = ttl
+        self.pageSize = pageSize
+        self.lock = threading.Lock()
+        self.cached = None
+        self.fetched = 0
+
+
+    def _fetch(self):
+
+        hwIds = set()
+        offset = 0
+        while True:
+            r = self.account.session.get(self.account.url(
+                'SoftLayer_Account/getHardware.json?objectMask=mask[id]'
+                '&resultLimit=%d,%d' % (offset, self.pageSize)))
+            r.raise_for_status()
+            page = r.json()
+            hwIds.update(hw['id'] for hw in page)
+            if len(page) < self.pageSize:
+                break
+            offset += self.pageSize
+
+        return frozenset(hwIds)
+
+
+    def ids(self):
+        ''' All hardware ids, refetched once the TTL runs out. Threads
+            arriving during a refetch wait for it instead of starting
+            their own. '''
+
+        with self.lock:
+            if self.cached is None or time.time() - self.fetched > self.ttl:
+                self.cached = self._fetch()
+                self.fetched = time.time()
+            return(self.cached)
+
+
+    def invalidate(self):
+
+        with self.lock:
+            self.cached = None
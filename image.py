@@ -6,48 +6,72 @@
 
 import os
 import SoftLayer
-import config
+import accounts
 import pprint
+from records import Image
 
 
 pp = pprint.PrettyPrinter(indent=4)
 
 
 class ImageConnector(object):
-    ''' This class sets up the SoftLayer connection '''
+    ''' This class sets up the SoftLayer connection, for the
+        config account or the account= passed in '''
 
-    def __init__(self):
+    def __init__(self, account=None):
 
-        self.client = config.client
+        self.account = accounts.resolve(account)
+        self.client = self.account.client
         self.mgr  = SoftLayer.ImageManager(self.client)
 
 
 class GetImgList(ImageConnector):
-    ''' This class gets the image list '''
+    ''' This class gets the image list. Private images can be read
+        from a local inventory.Inventory snapshot if one is passed in. '''
 
-    def __init__(self):
-        ImageConnector.__init__(self)
+    def __init__(self, inventory=None, account=None):
+        ImageConnector.__init__(self, account)
+        if inventory is not None:
+            inventory.check_account(self.account)
+        self.inventory = inventory
+
+
+    def getPriImages(self):
+        ''' Private images as compact Image records '''
+
+        if self.inventory is not None:
+            return self.inventory.all('images')
+
+        return [Image.from_api(i) for i in
+                self.mgr.list_private_images(mask=Image.mask)]
+
+
+    def getPubImages(self):
+        ''' Public images as compact Image records '''
+
+        return [Image.from_api(i) for i in
+                self.mgr.list_public_images(mask=Image.mask)]
 
 
     def getPriImgList(self):
 
-        result = self.mgr.list_private_images()
+        result = self.getPriImages()
         pp.pprint(result)
 
 
     def getPubImgList(self):
         ''' This is a list of OS images by SL '''
    
-        result = self.mgr.list_public_images()
+        result = self.getPubImages()
         pp.pprint(result)
 
 
 class GetImageInfo(ImageConnector):
     ''' Expects an image id to be passed in '''
 
-    def __init__(self,id):
+    def __init__(self,id, account=None):
 
-        ImageConnector.__init__(self) 
+        ImageConnector.__init__(self, account) 
 
         if isinstance(id, int):
             self.id = id
@@ -82,5 +106,6 @@ if __name__ == '__main__':
 
     # Get Image Info on Specific Image by id
     #res = GetImageInfo(1343957)    # or res = GetImageInfo('vm-demo')
+    pass
 
 
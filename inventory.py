@@ -0,0 +1,308 @@
+''' This file is part of the SL API package and holds a local
+    inventory snapshot of the account: virtual guests, private
+    images, users and hardware, kept in a SQLite file.
+
+    The first sync downloads everything.  Later syncs only ask for
+    objects whose modifyDate moved since the last sync, plus a
+    cheap listing of every id to drop anything that was cancelled
+    or deleted and to fetch, by id, anything new the date filter
+    missed.  Power state, tags and the active transaction live in
+    related objects and change without touching a guest's
+    modifyDate, so the guest listing also carries those and they
+    are rewritten for every guest on every sync.  Lookups then run
+    offline against indexed columns.
+
+    Each account (see accounts.py) gets its own file: the default
+    account ~/.sl_inventory.db, any other ~/.sl_inventory.<name>.db.
+
+    /* Example:
+    inv = Inventory()
+    inv.sync()                                  # delta unless first run
+    qa = Inventory(account=fleet['qa'])         # ~/.sl_inventory.qa.db
+    web = inv.by_tag('Nanigans WebApp VM')
+    off = inv.by_power_state('HALTED')
+    dave = inv.user_by_email('dave@nanigans.com')
+    */ '''
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from records import VirtualGuest, User, Image, Hardware
+
+
+DEFAULT_PATH = os.path.expanduser('~/.sl_inventory.db')
+
+
+def path_for(account):
+    ''' Snapshot file for the named account '''
+
+    if account == 'default':
+        return DEFAULT_PATH
+    return os.path.expanduser('~/.sl_inventory.%s.db' % account)
+
+# SL compares modifyDate in its own timezone so we look back a day
+# past our last sync.  Re-reading a few objects is harmless.
+SYNC_OVERLAP = 86400
+
+# Ids per request when fetching objects the delta filter missed
+FETCH_CHUNK = 200
+
+
+class _Kind(object):
+    ''' How one object type is fetched and indexed '''
+
+    def __init__(self, record, method, filterKey, columns, delta=True,
+                 volatile=(), liveMask='mask[id]'):
+
+        self.record = record
+        self.method = method
+        self.filterKey = filterKey
+        self.columns = columns
+        self.delta = delta
+        # API keys that change without modifyDate moving, and the
+        # per-sync listing mask that fetches them with the ids
+        self.volatile = volatile
+        self.liveMask = liveMask
+
+
+KINDS = {
+    'guests':   _Kind(VirtualGuest, 'getVirtualGuests', 'virtualGuests',
+                      ('hostname', 'datacenter', 'powerState', 'osCode'),
+                      volatile=('powerState', 'tagReferences', 'activeTransaction'),
+                      liveMask=('mask[id,powerState[keyName],tagReferences[tag[name]],'
+                                'activeTransaction[transactionStatus[name]]]')),
+    'images':   _Kind(Image, 'getPrivateBlockDeviceTemplateGroups',
+                      'privateBlockDeviceTemplateGroups', ('name',), delta=False),
+    'users':    _Kind(User, 'getUsers', 'users', ('username', 'email')),
+    'hardware': _Kind(Hardware, 'getHardware', 'hardware',
+                      ('hostname', 'datacenter')),
+}
+
+
+class Inventory(object):
+    ''' SQLite backed snapshot of the account inventory '''
+
+    def __init__(self, client=None, path=None, account=None):
+
+        self._client = client
+        self.account = account
+        self.accountName = account.name if account is not None else 'default'
+        if path is None:
+            path = path_for(self.accountName)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._create()
+
+
+    @property
+    def client(self):
+        ''' Only syncs need the API, so the account's client (and
+            SoftLayer with it) is built on first use. Offline reads
+            stay cheap. '''
+
+        if self._client is None:
+            import accounts
+            self._client = accounts.resolve(self.account).client
+
+        return(self._client)
+
+
+    def check_account(self, account):
+        ''' Raise ValueError unless this snapshot belongs to account
+            (None meaning the default account) '''
+
+        name = account.name if account is not None else 'default'
+        if name != self.accountName:
+            raise ValueError('Inventory %s is for account %s, not %s'
+                             % (self.path, self.accountName, name))
+
+
+    def _create(self):
+
+        with self.lock:
+            for kind, spec in KINDS.items():
+                cols = ''.join(', %s TEXT' % c for c in spec.columns)
+                self.db.execute('CREATE TABLE IF NOT EXISTS %s '
+                                '(id INTEGER PRIMARY KEY, data TEXT%s)' % (kind, cols))
+                for c in spec.columns:
+                    self.db.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)'
+                                    % (kind, c, kind, c))
+            self.db.execute('CREATE TABLE IF NOT EXISTS guest_tags '
+                            '(id INTEGER, tag TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS guest_tags_tag ON guest_tags (tag)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS guest_tags_id ON guest_tags (id)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS sync '
+                            '(kind TEXT PRIMARY KEY, synced REAL)')
+            self.db.commit()
+
+
+    def last_sync(self, kind):
+        ''' Epoch time of the last sync of kind, or None '''
+
+        with self.lock:
+            row = self.db.execute('SELECT synced FROM sync WHERE kind = ?',
+                                  (kind,)).fetchone()
+        return row[0] if row else None
+
+
+    def age(self, kind):
+        ''' Seconds since kind was last synced, None if never '''
+
+        last = self.last_sync(kind)
+        return None if last is None else time.time() - last
+
+
+    def sync(self, kinds=None, full=False):
+        ''' Refresh the snapshot.  Returns {kind: objects written}. '''
+
+        counts = {}
+        for kind in (kinds or sorted(KINDS)):
+            counts[kind] = self._sync_kind(kind, full)
+
+        return(counts)
+
+
+    def _sync_kind(self, kind, full):
+
+        spec = KINDS[kind]
+        account = self.client['SoftLayer_Account']
+        method = getattr(account, spec.method)
+        started = time.time()
+        last = self.last_sync(kind)
+
+        if full or last is None or not spec.delta:
+            objects = method(mask=spec.record.mask)
+            live = None
+        else:
+            since = time.strftime('%m/%d/%Y %H:%M:%S',
+                                  time.localtime(last - SYNC_OVERLAP))
+            objects = method(mask=spec.record.mask, filter={
+                spec.filterKey: {'modifyDate': {
+                    'operation': 'greaterThanDate',
+                    'options': [{'name': 'date', 'value': [since]}]}}})
+            live = dict((o['id'], o) for o in method(mask=spec.liveMask))
+
+            # New objects whose modifyDate did not pass the filter (SL
+            # leaves it null on some) are fetched by id.
+            with self.lock:
+                stored = set(r[0] for r in self.db.execute('SELECT id FROM %s' % kind))
+            missing = sorted(set(live) - stored - set(o['id'] for o in objects))
+            for start in range(0, len(missing), FETCH_CHUNK):
+                objects += method(mask=spec.record.mask, filter={
+                    spec.filterKey: {'id': {
+                        'operation': 'in',
+                        'options': [{'name': 'data',
+                                     'value': missing[start:start + FETCH_CHUNK]}]}}})
+
+        with self.lock:
+            if live is None:
+                self.db.execute('DELETE FROM %s' % kind)
+                if kind == 'guests':
+                    self.db.execute('DELETE FROM guest_tags')
+            else:
+                gone = [(i,) for i in stored - set(live)]
+                self.db.executemany('DELETE FROM %s WHERE id = ?' % kind, gone)
+                if kind == 'guests':
+                    self.db.executemany('DELETE FROM guest_tags WHERE id = ?', gone)
+
+                # Refresh the volatile fields of everything not refetched
+                if spec.volatile:
+                    fetched = set(o['id'] for o in objects)
+                    for id in (stored & set(live)) - fetched:
+                        row = self.db.execute('SELECT data FROM %s WHERE id = ?' % kind,
+                                              (id,)).fetchone()
+                        data = json.loads(row[0])
+                        for k in spec.volatile:
+                            data[k] = live[id].get(k)
+                        self._store(kind, spec, data)
+
+            for o in objects:
+                self._store(kind, spec, o)
+
+            self.db.execute('INSERT OR REPLACE INTO sync (kind, synced) VALUES (?, ?)',
+                            (kind, started))
+            self.db.commit()
+
+        return(len(objects))
+
+
+    def _store(self, kind, spec, data):
+
+        rec = spec.record.from_api(data)
+        cols = ('id', 'data') + spec.columns
+        values = [rec.id, json.dumps(data)] + [getattr(rec, c) for c in spec.columns]
+        self.db.execute('INSERT OR REPLACE INTO %s (%s) VALUES (%s)'
+                        % (kind, ', '.join(cols), ', '.join('?' * len(cols))), values)
+
+        if kind == 'guests':
+            self.db.execute('DELETE FROM guest_tags WHERE id = ?', (rec.id,))
+            self.db.executemany('INSERT INTO guest_tags (id, tag) VALUES (?, ?)',
+                                [(rec.id, t) for t in rec.tags])
+
+
+    def _select(self, kind, sql, args=()):
+
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        record = KINDS[kind].record
+        return [record.from_api(json.loads(r[0])) for r in rows]
+
+
+    def all(self, kind):
+        ''' Every object of kind as records '''
+
+        return self._select(kind, 'SELECT data FROM %s ORDER BY id' % kind)
+
+
+    def query(self, kind, **where):
+        ''' Records of kind matching every indexed column given.
+            Example: inv.query('guests', datacenter='dal10', powerState='RUNNING') '''
+
+        for c in where:
+            if c not in KINDS[kind].columns:
+                raise ValueError('%s is not an indexed column of %s' % (c, kind))
+
+        cols = sorted(where)
+        sql = 'SELECT data FROM %s' % kind
+        if cols:
+            sql += ' WHERE ' + ' AND '.join('%s = ?' % c for c in cols)
+        return self._select(kind, sql + ' ORDER BY id', [where[c] for c in cols])
+
+
+    def by_hostname(self, hostname):
+
+        return self.query('guests', hostname=hostname)
+
+
+    def by_datacenter(self, datacenter):
+
+        return self.query('guests', datacenter=datacenter)
+
+
+    def by_power_state(self, powerState):
+
+        return self.query('guests', powerState=powerState)
+
+
+    def by_tag(self, tag):
+
+        return self._select('guests', 'SELECT g.data FROM guests g JOIN guest_tags t '
+                            'ON g.id = t.id WHERE t.tag = ? ORDER BY g.id', (tag,))
+
+
+    def user_by_email(self, email):
+
+        return self.query('users', email=email)
+
+
+    def user_by_username(self, username):
+
+        return self.query('users', username=username)
+
+
+    def close(self):
+
+        self.db.close()
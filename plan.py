@@ -0,0 +1,320 @@
+''' This file is part of the SL API package and holds the plan/apply
+    engine for bulk changes described as a desired-state file.
+
+    A state file is JSON listing the guests and users we want:
+
+    {
+      "guests": [ {"hostname": "web01", "type": "webapp"} ],
+      "users":  [ {"username": "jdoe", "email": "jdoe@nanigans.com",
+                   "firstname": "J", "lastname": "Doe",
+                   "device_access": true, "default_perms": true,
+                   "vpn": {"ssl": true, "pptp": false}} ]
+    }
+
+    Plan.build compares it to the local inventory and emits only the
+    operations needed: order + wait for missing guests, create for
+    missing users, then device access, perms and VPN flags.  Device
+    access and perms are applied to new users (or every listed user
+    with "enforce": true) since we cannot cheaply read them back; VPN
+    flags are only set where the inventory shows they differ.
+
+    Operations form a DAG.  apply runs every operation whose
+    dependencies are done on a bounded worker pool, and records each
+    finished operation in a checkpoint file so a failed run can be
+    re-applied and pick up where it stopped.  Pass the same
+    checkpoint to build: a guest or user the checkpoint shows we
+    created is planned as new again, so its follow-up operations
+    are still emitted even though the inventory now has it.
+
+    /* Example:
+    myPlan = Plan.build(load_state('rollout.json'), Inventory(),
+                        load_checkpoint('rollout.ckpt'))
+    myPlan.show()
+    myPlan.apply(workers=8, checkpoint='rollout.ckpt')
+    */ '''
+
+import os
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+import tracing
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def load_state(path):
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_checkpoint(path):
+    ''' {op id: result} from a checkpoint file, empty if there is none '''
+
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class Op(object):
+    ''' One API operation in the plan.  fn gets the results of
+        finished ops keyed by op id. '''
+
+    def __init__(self, id, description, fn, deps=()):
+
+        self.id = id
+        self.description = description
+        self.fn = fn
+        self.deps = list(deps)
+
+
+    def __repr__(self):
+
+        return 'Op(%r)' % self.id
+
+
+# Operation bodies. Heavy modules are imported on use.
+
+def _order(hostname, vmType, account):
+
+    def run(results):
+        import vm_controls
+        return vm_controls.VmOrder(hostname, vmType, account=account).vsi['id']
+    return run
+
+
+def _wait(hostname, account):
+
+    def run(results):
+        import vm_controls
+        vmId = results['order:' + hostname]
+        vm_controls.VmStatus(hostname, account=account).vm_monitor(vmId)
+        return vmId
+    return run
+
+
+def _create_user(user, account):
+
+    def run(results):
+        import users
+        created = users.UserManager(username=user['username'], email=user['email'],
+                                    firstname=user.get('firstname', 'None'),
+                                    lastname=user.get('lastname', 'None'),
+                                    account=account).create_user()
+        return created['id']
+    return run
+
+
+def _sluid(results, username, sluid):
+
+    if sluid is not None:
+        return sluid
+    return results['create:' + username]
+
+
+def _device_access(username, sluid, account):
+
+    def run(results):
+        import users
+        users.UserManager(sluid=_sluid(results, username, sluid),
+                          account=account).set_default_device_access()
+    return run
+
+
+def _perms(username, sluid, account):
+
+    def run(results):
+        import users
+        users.UserManager(sluid=_sluid(results, username, sluid),
+                          account=account).set_default_portal_perms()
+    return run
+
+
+def _vpn(username, sluid, ssl, pptp, account):
+
+    def run(results):
+        import users
+        users.UserManager(sluid=_sluid(results, username, sluid),
+                          account=account).set_user_vpn_status(ssl=ssl, pptp=pptp)
+    return run
+
+
+class PlanError(Exception):
+    ''' Raised when apply finishes with failed operations '''
+
+    def __init__(self, failed, skipped):
+
+        Exception.__init__(self, 'failed: %s; skipped: %s' % (
+            ', '.join(sorted(failed)), ', '.join(sorted(skipped))))
+        self.failed = failed
+        self.skipped = skipped
+
+
+class Plan(object):
+    ''' Ordered set of Ops with dependencies '''
+
+    def __init__(self, ops=()):
+
+        self.ops = []
+        self.byId = {}
+        self.done = {}
+        for op in ops:
+            self.add(op)
+
+
+    def add(self, op):
+
+        for dep in op.deps:
+            if dep not in self.byId:
+                raise ValueError('%s depends on unknown op %s' % (op.id, dep))
+        self.ops.append(op)
+        self.byId[op.id] = op
+        return(op)
+
+
+    @classmethod
+    def build(cls, state, inventory, checkpoint=None):
+        ''' Diff the desired state against the inventory snapshot.
+            checkpoint is {op id: result} from an earlier apply.  Ops
+            run against the inventory's account. '''
+
+        plan = cls()
+        account = inventory.account
+        checkpoint = checkpoint or {}
+        plan.done = checkpoint
+
+        existing = set(g.hostname for g in inventory.all('guests'))
+        for guest in state.get('guests', []):
+            hostname = guest['hostname']
+            if hostname in existing and 'order:' + hostname not in checkpoint:
+                continue
+            plan.add(Op('order:' + hostname, 'order %s (%s)' % (hostname, guest['type']),
+                        _order(hostname, guest['type'], account)))
+            plan.add(Op('wait:' + hostname, 'wait for %s' % hostname,
+                        _wait(hostname, account), ['order:' + hostname]))
+
+        for user in state.get('users', []):
+            username = user['username']
+            found = inventory.user_by_username(username)
+            current = found[0] if found else None
+            if 'create:' + username in checkpoint:
+                # We created it on an earlier run; finish the job
+                current = None
+            sluid = current.id if current else None
+            first = []
+
+            if current is None:
+                first = [plan.add(Op('create:' + username, 'create user %s' % username,
+                                     _create_user(user, account))).id]
+
+            enforce = current is None or user.get('enforce', False)
+
+            # Device access only covers hardware, so it does not wait on
+            # guests we order.  Perms go on after access as they would
+            # by hand.
+            after = first
+            if user.get('device_access') and enforce:
+                after = [plan.add(Op('device_access:' + username,
+                                     'grant %s default device access' % username,
+                                     _device_access(username, sluid, account), first)).id]
+
+            if user.get('default_perms') and enforce:
+                plan.add(Op('perms:' + username, 'set %s default portal perms' % username,
+                            _perms(username, sluid, account), after))
+
+            vpn = user.get('vpn')
+            if vpn is not None:
+                ssl, pptp = vpn.get('ssl', False), vpn.get('pptp', False)
+                have = None
+                if current is not None:
+                    have = (bool(current.sslVpnAllowedFlag), bool(current.pptpVpnAllowedFlag))
+                if have != (ssl, pptp):
+                    plan.add(Op('vpn:' + username,
+                                'set %s vpn ssl=%s pptp=%s' % (username, ssl, pptp),
+                                _vpn(username, sluid, ssl, pptp, account), first))
+
+        return(plan)
+
+
+    def show(self):
+
+        if not self.ops:
+            print("Nothing to do")
+        for op in self.ops:
+            deps = ' (after %s)' % ', '.join(op.deps) if op.deps else ''
+            done = ' [done]' if op.id in self.done else ''
+            print("%s%s%s" % (op.description, deps, done))
+
+
+    def apply(self, workers=4, checkpoint=None):
+        ''' Run the plan. Returns {op id: result}. Ops already in the
+            checkpoint file are not run again. '''
+
+        results = load_checkpoint(checkpoint)
+
+        lock = threading.Lock()
+        finished = queue.Queue()
+        pending = dict((op.id, op) for op in self.ops if op.id not in results)
+        running = set()
+        failed = {}
+        skipped = set()
+
+        def run(op):
+            try:
+                with lock:
+                    snapshot = dict(results)
+                finished.put((op.id, op.fn(snapshot), None))
+            except Exception as e:
+                finished.put((op.id, None, e))
+
+        pool = ThreadPool(workers)
+        try:
+            while pending or running:
+                for id, op in list(pending.items()):
+                    if any(d in failed or d in skipped for d in op.deps):
+                        skipped.add(id)
+                        del pending[id]
+                    elif all(d in results for d in op.deps):
+                        print("Starting: %s" % op.description)
+                        running.add(id)
+                        del pending[id]
+                        pool.apply_async(tracing.bind(run), (op,))
+
+                if not running:
+                    break
+
+                id, result, error = finished.get()
+                running.discard(id)
+                if error is not None:
+                    print("Failed: %s: %s" % (self.byId[id].description, error))
+                    failed[id] = error
+                    continue
+
+                print("Done: %s" % self.byId[id].description)
+                with lock:
+                    results[id] = result
+                if checkpoint:
+                    self._checkpoint(checkpoint, results)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Anything left waited on something that failed
+        skipped.update(pending)
+
+        if failed or skipped:
+            raise PlanError(failed, skipped)
+
+        return(results)
+
+
+    def _checkpoint(self, path, results):
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(results, f, default=str)
+        os.rename(tmp, path)
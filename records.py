@@ -0,0 +1,181 @@
+''' This file is part of the SL API package and holds compact
+    record types for the objects we list in bulk: virtual guests,
+    users, images and hardware.
+
+    The API hands back big nested dicts.  Holding a whole account
+    that way is heavy, so a record keeps only the scalar fields we
+    filter on in __slots__, and keeps the nested pieces (datacenter,
+    powerState, tags, OS) as the raw sub-dict until first read.
+
+    /* Example:
+    guests = [VirtualGuest.from_api(g) for g in virtualGuests]
+    running = [g for g in guests if g.powerState == 'RUNNING']
+    print(running[0].datacenter)
+    */ '''
+
+
+class Record(object):
+    ''' Base class for slotted records.  Subclasses list the plain
+        API keys in fields and the nested API keys in raw; every raw
+        key gets a '_' prefixed slot holding the unparsed sub-dict.
+        The properties reading those slots are listed in parsed. '''
+
+    __slots__ = ()
+    fields = ()
+    raw = ()
+    parsed = ()
+
+    # objectMask that fetches just what the record holds
+    mask = ''
+
+
+    @classmethod
+    def from_api(cls, data):
+        ''' Build a record from an API dict, dropping anything
+            we do not keep. '''
+
+        self = cls.__new__(cls)
+        for k in cls.fields:
+            setattr(self, k, data.get(k))
+        for k in cls.raw:
+            setattr(self, '_' + k, data.get(k))
+
+        return(self)
+
+
+    def to_dict(self):
+        ''' Plain dict of the record, nested fields parsed '''
+
+        d = {}
+        for k in self.fields + self.parsed:
+            d[k] = getattr(self, k)
+
+        return(d)
+
+
+    def __eq__(self, other):
+
+        return type(self) is type(other) and self.id == other.id
+
+
+    def __ne__(self, other):
+
+        return not self == other
+
+
+    def __hash__(self):
+
+        return hash((type(self).__name__, self.id))
+
+
+    def __repr__(self):
+
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (k, getattr(self, k)) for k in self.fields))
+
+
+def _get(raw, *path):
+    ''' Walk a nested API dict, returning None on any gap '''
+
+    for k in path:
+        if not isinstance(raw, dict):
+            return None
+        raw = raw.get(k)
+
+    return(raw)
+
+
+class VirtualGuest(Record):
+
+    fields = ('id', 'hostname', 'domain', 'fullyQualifiedDomainName',
+              'maxCpu', 'maxMemory', 'primaryIpAddress',
+              'primaryBackendIpAddress', 'modifyDate', 'provisionDate')
+    raw = ('datacenter', 'powerState', 'tagReferences', 'operatingSystem',
+           'activeTransaction')
+    parsed = ('datacenter', 'powerState', 'tags', 'osCode', 'activeTransaction')
+
+    __slots__ = fields + tuple('_' + k for k in raw)
+
+    mask = ('mask[id,hostname,domain,fullyQualifiedDomainName,maxCpu,maxMemory,'
+            'primaryIpAddress,primaryBackendIpAddress,modifyDate,provisionDate,datacenter[name],'
+            'powerState[keyName],tagReferences[tag[name]],'
+            'operatingSystem[softwareLicense[softwareDescription[referenceCode]]],'
+            'activeTransaction[transactionStatus[name]]]')
+
+
+    @property
+    def datacenter(self):
+
+        return _get(self._datacenter, 'name')
+
+
+    @property
+    def powerState(self):
+
+        return _get(self._powerState, 'keyName')
+
+
+    @property
+    def tags(self):
+
+        return [_get(t, 'tag', 'name') for t in (self._tagReferences or [])]
+
+
+    @property
+    def osCode(self):
+
+        return _get(self._operatingSystem, 'softwareLicense',
+                    'softwareDescription', 'referenceCode')
+
+
+    @property
+    def activeTransaction(self):
+
+        return _get(self._activeTransaction, 'transactionStatus', 'name')
+
+
+class User(Record):
+
+    fields = ('id', 'username', 'email', 'firstName', 'lastName',
+              'userStatusId', 'sslVpnAllowedFlag', 'pptpVpnAllowedFlag')
+
+    __slots__ = fields
+
+    mask = ('mask[id,username,email,firstName,lastName,userStatusId,'
+            'sslVpnAllowedFlag,pptpVpnAllowedFlag]')
+
+
+class Image(Record):
+
+    fields = ('id', 'name', 'globalIdentifier', 'note', 'createDate')
+    raw = ('datacenters',)
+    parsed = ('datacenters',)
+
+    __slots__ = fields + ('_datacenters',)
+
+    mask = 'mask[id,name,globalIdentifier,note,createDate,datacenters[name]]'
+
+
+    @property
+    def datacenters(self):
+
+        return [_get(d, 'name') for d in (self._datacenters or [])]
+
+
+class Hardware(Record):
+
+    fields = ('id', 'hostname', 'domain', 'fullyQualifiedDomainName',
+              'primaryIpAddress', 'modifyDate')
+    raw = ('datacenter',)
+    parsed = ('datacenter',)
+
+    __slots__ = fields + ('_datacenter',)
+
+    mask = ('mask[id,hostname,domain,fullyQualifiedDomainName,'
+            'primaryIpAddress,modifyDate,datacenter[name]]')
+
+
+    @property
+    def datacenter(self):
+
+        return _get(self._datacenter, 'name')
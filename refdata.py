@@ -0,0 +1,215 @@
+''' This file is part of the SL API package and holds the cache of
+    reference data that almost never changes: timezones, user status
+    types, datacenters and the OS codes VmOrder profiles use.
+
+    Each table is fetched once, saved to ~/.sl_refdata.json with the
+    time it was fetched and a format version, and reused until it is
+    older than the TTL (a week by default).  Lookups are by id or by
+    any of the names SL gives the entry, case-insensitive.  A name
+    several entries share (timezone short names like 'EST') is
+    refused rather than resolved to whichever SL listed first, so
+    provisioning code can say 'America/New_York', 'DISABLED' or
+    'dal10' without an API call.
+
+    Each account (see accounts.py) has its own ReferenceData, fetched
+    with that account's client; the default account's is saved to
+    ~/.sl_refdata.json and any other's to ~/.sl_refdata.<name>.json.
+
+    /* Example:
+    reference = accounts.default().reference
+    reference.timezone_id('America/New_York')   # 120
+    reference.user_status_id('DISABLED')    # 1002
+    reference.check_order({'datacenter': 'dal10', 'os_code': 'CentOS_6_64'})
+    reference.refresh()                     # force a refetch of everything
+    */ '''
+
+import os
+import json
+import time
+import threading
+
+
+DEFAULT_PATH = os.path.expanduser('~/.sl_refdata.json')
+
+# Bump when the saved layout changes; older files are ignored
+FORMAT_VERSION = 1
+
+DEFAULT_TTL = 7 * 86400
+
+
+def path_for(account):
+    ''' Cache file for the named account '''
+
+    if account == 'default':
+        return DEFAULT_PATH
+    return os.path.expanduser('~/.sl_refdata.%s.json' % account)
+
+
+def _timezones(client):
+
+    return [{'id': t['id'], 'names': [t.get('shortName'), t.get('name'), t.get('longName')]}
+            for t in client['SoftLayer_Locale_Timezone'].getAllObjects()]
+
+
+def _user_statuses(client):
+
+    return [{'id': s['id'], 'names': [s.get('keyName'), s.get('name')]}
+            for s in client['SoftLayer_User_Customer_Status'].getAllObjects()]
+
+
+def _datacenters(client):
+
+    return [{'id': d['id'], 'names': [d.get('name'), d.get('longName')]}
+            for d in client['SoftLayer_Location'].getDatacenters()]
+
+
+def _os_codes(client):
+
+    options = client['SoftLayer_Virtual_Guest'].getCreateObjectOptions()
+    codes = []
+    for o in options.get('operatingSystems', []):
+        code = o['template']['operatingSystemReferenceCode']
+        desc = o.get('itemPrice', {}).get('item', {}).get('description')
+        codes.append({'id': code, 'names': [code, desc]})
+    return(codes)
+
+
+LOADERS = {
+    'timezones':    _timezones,
+    'userStatuses': _user_statuses,
+    'datacenters':  _datacenters,
+    'osCodes':      _os_codes,
+}
+
+
+class ReferenceData(object):
+    ''' Disk backed, TTL'd cache of SL lookup tables '''
+
+    def __init__(self, client=None, path=DEFAULT_PATH, ttl=DEFAULT_TTL, account=None):
+
+        self._client = client
+        self.account = account
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.fetched = {}
+        self.index = {}
+        self.ambiguous = {}
+        self._read()
+
+
+    @property
+    def client(self):
+
+        if self._client is None:
+            import accounts
+            self._client = accounts.resolve(self.account).client
+        return(self._client)
+
+
+    def _read(self):
+
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if saved.get('version') != FORMAT_VERSION:
+            return
+        for kind, rows in saved.get('tables', {}).items():
+            if kind in LOADERS:
+                self._set(kind, rows, saved['fetched'][kind])
+
+
+    def _write(self):
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'tables': self.tables,
+                       'fetched': self.fetched}, f)
+        os.rename(tmp, self.path)
+
+
+    def _set(self, kind, rows, fetched):
+
+        index = {}
+        ambiguous = {}
+        for row in rows:
+            for name in set(str(n).lower() for n in row['names'] if n):
+                if name in ambiguous:
+                    ambiguous[name].append(row['id'])
+                elif name in index:
+                    ambiguous[name] = [index.pop(name)['id'], row['id']]
+                else:
+                    index[name] = row
+        # ids always resolve
+        for row in rows:
+            index[str(row['id']).lower()] = row
+            ambiguous.pop(str(row['id']).lower(), None)
+        self.tables[kind] = rows
+        self.fetched[kind] = fetched
+        self.index[kind] = index
+        self.ambiguous[kind] = ambiguous
+
+
+    def table(self, kind):
+        ''' Rows of kind, fetched from SL only if missing or stale '''
+
+        with self.lock:
+            if kind not in self.tables or time.time() - self.fetched[kind] > self.ttl:
+                self._set(kind, LOADERS[kind](self.client), time.time())
+                self._write()
+            return self.tables[kind]
+
+
+    def refresh(self, kinds=None):
+
+        with self.lock:
+            for kind in (kinds or sorted(LOADERS)):
+                self._set(kind, LOADERS[kind](self.client), time.time())
+            self._write()
+
+
+    def lookup(self, kind, key):
+        ''' The row whose id or any name matches key. KeyError if none,
+            or if the name belongs to more than one row. '''
+
+        self.table(kind)
+        ids = self.ambiguous[kind].get(str(key).lower())
+        if ids:
+            raise KeyError('Ambiguous %s: %s matches ids %s' % (
+                kind, key, ', '.join(str(i) for i in ids)))
+        try:
+            return self.index[kind][str(key).lower()]
+        except KeyError:
+            raise KeyError('Unknown %s: %s' % (kind, key))
+
+
+    def timezone_id(self, name):
+
+        return self.lookup('timezones', name)['id']
+
+
+    def user_status_id(self, name):
+
+        return self.lookup('userStatuses', name)['id']
+
+
+    def datacenter_id(self, name):
+
+        return self.lookup('datacenters', name)['id']
+
+
+    def check_order(self, vsi):
+        ''' Raise ValueError if a VmOrder profile names a datacenter or
+            OS code SL does not offer. '''
+
+        for kind, field in (('datacenters', 'datacenter'), ('osCodes', 'os_code')):
+            if field in vsi:
+                try:
+                    self.lookup(kind, vsi[field])
+                except KeyError as e:
+                    raise ValueError(str(e).strip("'"))
+
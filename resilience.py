@@ -0,0 +1,316 @@
+''' This file is part of the SL API package and holds the retry,
+    circuit breaker and idempotency layer wrapped around calls that
+    change things at SoftLayer (power, reboot, order, user edits).
+
+    call() runs one mutating request:
+
+      - errors are classified.  Transient ones (HTTP 429/5xx,
+        connection failures, SL rate limiting) are retried with
+        exponential backoff and jitter; permanent ones are raised
+        straight away.
+      - each endpoint has a circuit breaker.  After too many transient
+        failures in a row the endpoint is skipped for a cool down
+        instead of burning time on calls that will fail.
+      - a done() check runs before every attempt, so we skip a
+        powerOn for a guest that is already running, or a retried
+        order that actually went through the first time.  Errors
+        from done() are classified and retried like the call's own.
+      - an idempotency key, once it has succeeded, is not sent again
+        by this process for a couple of minutes.  That catches a double
+        submitted job, not a deliberate repeat later on.  Calls with a
+        done() check do not need one.
+
+    Breakers and idempotency keys are kept per account (see
+    accounts.py), so one account's outage does not stop the others.
+
+    /* Example:
+    result = resilience.call('SoftLayer_Virtual_Guest::powerOn',
+                             client['SoftLayer_Virtual_Guest'].powerOn,
+                             kwargs={'id': 1234},
+                             done=lambda: powerState(1234) == 'RUNNING',
+                             account='prod')
+    if result is resilience.SKIPPED:
+        print("already running")
+    */ '''
+
+import time
+import random
+import threading
+import tracing
+
+
+# SoftLayer fault codes worth retrying
+TRANSIENT_FAULTS = (
+    'SoftLayer_Exception_WebService_RateLimitExceeded',
+    'SoftLayer_Exception_Public_Timeout',
+)
+
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+
+class TransientError(Exception):
+    ''' A retryable failure, e.g. an HTTP 503 from the REST API '''
+
+
+class PermanentError(Exception):
+    ''' A failure retrying will not fix, e.g. an HTTP 404 from the
+        REST API.  response is the requests Response. '''
+
+    def __init__(self, message, response=None):
+
+        Exception.__init__(self, message)
+        self.response = response
+
+
+class CircuitOpenError(Exception):
+    ''' The endpoint's breaker is open; the call was not sent '''
+
+
+class _Skipped(object):
+
+    def __repr__(self):
+
+        return 'SKIPPED'
+
+
+# Returned by call() when done() says the change is already in place
+SKIPPED = _Skipped()
+
+
+def classify(error):
+    ''' 'transient' or 'permanent' '''
+
+    if isinstance(error, TransientError):
+        return 'transient'
+
+    # requests exceptions, matched by name so we do not import requests
+    for cls in type(error).__mro__:
+        if cls.__name__ in ('ConnectionError', 'Timeout'):
+            return 'transient'
+
+    code = getattr(error, 'faultCode', None)
+    if isinstance(code, int):
+        # SoftLayer's TransportError uses the HTTP status, 0 if the
+        # connection itself failed
+        if code == 0 or code in TRANSIENT_STATUS:
+            return 'transient'
+    elif code in TRANSIENT_FAULTS:
+        return 'transient'
+
+    return 'permanent'
+
+
+def check(response):
+    ''' Raise TransientError for a retryable REST response and
+        PermanentError for any other 4xx/5xx, otherwise hand it back. '''
+
+    url = response.url.split('@')[-1]
+    if response.status_code in TRANSIENT_STATUS:
+        raise TransientError('HTTP %s from %s' % (response.status_code, url))
+    if response.status_code >= 400:
+        # SL puts the reason in {"error": ..., "code": ...}
+        try:
+            reason = response.json().get('error')
+        except (ValueError, AttributeError):
+            reason = None
+        raise PermanentError('HTTP %s from %s: %s' % (response.status_code, url,
+                                                      reason or response.reason),
+                             response)
+    return(response)
+
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=4, base=0.5, cap=30):
+
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+
+
+    def delay(self, attempt):
+        ''' Backoff before retry number attempt (0 based) '''
+
+        return min(self.cap, self.base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class CircuitBreaker(object):
+    ''' Opens after threshold transient failures in a row and stays
+        open for reset seconds.  Then one trial call is let through;
+        if it works the breaker closes again. '''
+
+    def __init__(self, name, threshold=5, reset=60):
+
+        self.name = name
+        self.threshold = threshold
+        self.reset = reset
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.openedAt = None
+        self.trial = False
+
+
+    def allow(self):
+
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if time.time() - self.openedAt >= self.reset and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+
+    def success(self):
+
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.trial = False
+
+
+    def failure(self):
+
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.openedAt = time.time()
+            self.trial = False
+
+
+    @property
+    def state(self):
+
+        if self.openedAt is None:
+            return 'closed'
+        return 'half-open' if self.trial else 'open'
+
+
+_breakers = {}
+_breakersLock = threading.Lock()
+
+
+def breaker(endpoint, account=None):
+    ''' The shared breaker for an endpoint on one account '''
+
+    with _breakersLock:
+        if (account, endpoint) not in _breakers:
+            _breakers[(account, endpoint)] = CircuitBreaker(
+                endpoint if account is None else '%s %s' % (account, endpoint))
+        return _breakers[(account, endpoint)]
+
+
+class IdempotencyLedger(object):
+    ''' Keys of mutations that already succeeded, kept for ttl seconds '''
+
+    def __init__(self, ttl=120):
+
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.done = {}
+
+
+    def seen(self, key):
+
+        with self.lock:
+            at = self.done.get(key)
+            if at is not None and time.time() - at > self.ttl:
+                del self.done[key]
+                at = None
+            return at is not None
+
+
+    def record(self, key):
+
+        with self.lock:
+            self.done[key] = time.time()
+
+
+ledger = IdempotencyLedger()
+
+
+class RateLimiter(object):
+    ''' Token bucket shared by worker threads: at most rate calls per
+        second on average, bursts of up to burst calls. '''
+
+    def __init__(self, rate, burst=None):
+
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def call(endpoint, fn, args=(), kwargs=None, done=None, key=None,
+         policy=DEFAULT_POLICY, account=None):
+    ''' Run fn(*args, **kwargs) against endpoint with classified
+        retries.  Returns fn's result, or SKIPPED if key already
+        succeeded or done() reports the change is in place.  account
+        is the account name the breaker and key belong to. '''
+
+    if key is not None:
+        key = (account, key)
+
+    with tracing.span('api ' + endpoint, endpoint=endpoint) as sp:
+        result = _call(sp, endpoint, fn, args, kwargs or {}, done, key, policy, account)
+        if result is SKIPPED:
+            sp.set('skipped', True)
+        elif tracing.enabled():
+            sp.set('payload.bytes', tracing.payload_size(result))
+        return(result)
+
+
+def _call(sp, endpoint, fn, args, kwargs, done, key, policy, account):
+
+    if key is not None and ledger.seen(key):
+        return SKIPPED
+
+    cb = breaker(endpoint, account)
+    attempt = 0
+    while True:
+        if not cb.allow():
+            raise CircuitOpenError('%s is failing, circuit open' % endpoint)
+
+        # done() is an API call too, so it is retried and counted by
+        # the breaker the same as the mutation
+        try:
+            if done is not None and done():
+                cb.success()
+                if key is not None:
+                    ledger.record(key)
+                return SKIPPED
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if classify(e) == 'permanent':
+                cb.success()    # the endpoint answered, just not how we liked
+                raise
+            cb.failure()
+            attempt += 1
+            sp.set('retries', attempt)
+            if attempt >= policy.attempts:
+                raise
+            time.sleep(policy.delay(attempt - 1))
+            continue
+
+        cb.success()
+        if key is not None:
+            ledger.record(key)
+        return(result)
@@ -0,0 +1,243 @@
+''' This file is part of the SL API package and holds the selector
+    language used to target a fleet of virtual guests instead of a
+    single hostname.
+
+    A selector is a comma separated list of terms, all of which must
+    match.  Each term is  key op value  where key is one of
+
+        tag, dc (or datacenter), hostname, power, os, cpu, memory
+
+    and op is one of
+
+        =    equal                  !=   not equal
+        ~    glob  (web-*)          =~   regex (^web-[0-9]+$)
+        >= <= > <                   numeric, cpu and memory only
+
+    Terms that SoftLayer can evaluate are compiled into an
+    objectFilter so the account listing comes back already
+    narrowed.  Every term is also compiled to a local predicate
+    which is run over the returned records in one pass.
+
+    A selector with no terms at all is refused rather than taken to
+    mean every guest on the account.
+
+    /* Example:
+    sel = Selector('tag=Nanigans WebApp VM, dc=dal10, power=halted')
+    guests = sel.select(config.client)
+    guests = sel.select_inventory(Inventory())     # offline
+    */ '''
+
+import re
+import fnmatch
+from records import VirtualGuest
+
+
+_TERM = re.compile(r'^\s*(\w+)\s*(!=|=~|>=|<=|=|~|>|<)\s*(.*?)\s*$')
+
+_KEYS = {
+    'tag':        'tags',
+    'dc':         'datacenter',
+    'datacenter': 'datacenter',
+    'hostname':   'hostname',
+    'power':      'powerState',
+    'os':         'osCode',
+    'cpu':        'maxCpu',
+    'memory':     'maxMemory',
+}
+
+# objectFilter path under virtualGuests for each record attribute
+_PATHS = {
+    'tags':       ('tagReferences', 'tag', 'name'),
+    'datacenter': ('datacenter', 'name'),
+    'hostname':   ('hostname',),
+    'powerState': ('powerState', 'keyName'),
+    'osCode':     ('operatingSystem', 'softwareLicense',
+                   'softwareDescription', 'referenceCode'),
+    'maxCpu':     ('maxCpu',),
+    'maxMemory':  ('maxMemory',),
+}
+
+_NUMERIC = ('maxCpu', 'maxMemory')
+
+
+class SelectorError(ValueError):
+    ''' Raised for a selector we cannot parse '''
+
+
+class Term(object):
+    ''' One parsed  key op value  term '''
+
+    __slots__ = ('attr', 'op', 'value', 'test')
+
+    def __init__(self, attr, op, value):
+
+        self.attr = attr
+        self.op = op
+        self.value = value
+        self.test = self._compile()
+
+
+    def _compile(self):
+
+        op, value = self.op, self.value
+
+        if self.attr in _NUMERIC:
+            if op in ('~', '=~'):
+                raise SelectorError('%s does not take %s' % (self.attr, op))
+            try:
+                n = int(value)
+            except ValueError:
+                raise SelectorError('%s needs a number, got %r' % (self.attr, value))
+            return {
+                '=':  lambda v: v == n,
+                '!=': lambda v: v != n,
+                '>=': lambda v: v is not None and v >= n,
+                '<=': lambda v: v is not None and v <= n,
+                '>':  lambda v: v is not None and v > n,
+                '<':  lambda v: v is not None and v < n,
+            }[op]
+
+        if op in ('>=', '<=', '>', '<'):
+            raise SelectorError('%s does not take %s' % (self.attr, op))
+
+        if self.attr == 'powerState':
+            value = value.upper()
+
+        if op == '=':
+            return lambda v: v == value
+        if op == '!=':
+            return lambda v: v != value
+        if op == '~':
+            rx = re.compile(fnmatch.translate(value))
+        else:
+            rx = re.compile(value)
+        return lambda v: v is not None and rx.match(v) is not None
+
+
+    def match(self, guest):
+
+        v = getattr(guest, self.attr)
+        if self.attr == 'tags':
+            if self.op == '!=':
+                return all(self.test(t) for t in v)
+            return any(self.test(t) for t in v)
+
+        return self.test(v)
+
+
+    def operation(self):
+        ''' The objectFilter operation for this term, or None if
+            SoftLayer cannot evaluate it for us. '''
+
+        op, value = self.op, self.value
+
+        if self.attr in _NUMERIC:
+            if op == '=':
+                return value
+            if op in ('>=', '<=', '>', '<'):
+                return '%s %s' % (op, value)
+            return None
+
+        if self.attr == 'powerState':
+            value = value.upper()
+
+        if op == '=':
+            return value
+        if op == '~':
+            body = value.strip('*')
+            if any(c in body for c in '*?['):
+                return None
+            if value.startswith('*') and value.endswith('*'):
+                return '*= %s' % body
+            if value.endswith('*'):
+                return '^= %s' % body
+            if value.startswith('*'):
+                return '$= %s' % body
+            return body
+
+        return None
+
+
+class Selector(object):
+    ''' A parsed selector.  See the module docstring for syntax. '''
+
+    def __init__(self, text):
+
+        self.text = text
+        self.terms = []
+
+        for part in text.split(','):
+            if not part.strip():
+                continue
+            m = _TERM.match(part)
+            if not m or m.group(1) not in _KEYS:
+                raise SelectorError('Bad selector term %r' % part.strip())
+            key, op, value = m.groups()
+            self.terms.append(Term(_KEYS[key], op, value))
+
+        # No terms would match every guest on the account
+        if not self.terms:
+            raise SelectorError('Empty selector %r' % text)
+
+
+    def object_filter(self):
+        ''' objectFilter for SoftLayer_Account::getVirtualGuests built
+            from the terms SL can evaluate.  None if there are none. '''
+
+        guests = {}
+        for term in self.terms:
+            operation = term.operation()
+            if operation is None:
+                continue
+
+            node = guests
+            for k in _PATHS[term.attr]:
+                node = node.setdefault(k, {})
+            # Two terms on one field cannot share a node; the second
+            # is left to the local pass.
+            if 'operation' not in node:
+                node['operation'] = operation
+
+        if not guests:
+            return None
+
+        return {'virtualGuests': guests}
+
+
+    def match(self, guest):
+
+        for term in self.terms:
+            if not term.match(guest):
+                return False
+
+        return True
+
+
+    def filter(self, guests):
+        ''' Records from guests matching every term '''
+
+        terms = self.terms
+        return [g for g in guests if all(t.match(g) for t in terms)]
+
+
+    def select(self, client):
+        ''' Ask SL for matching guests and return them as records '''
+
+        kwargs = {'mask': VirtualGuest.mask}
+        objectFilter = self.object_filter()
+        if objectFilter is not None:
+            kwargs['filter'] = objectFilter
+
+        guests = client['SoftLayer_Account'].getVirtualGuests(**kwargs)
+        return self.filter([VirtualGuest.from_api(g) for g in guests])
+
+
+    def select_inventory(self, inventory):
+        ''' Matching guests from a local inventory.Inventory snapshot '''
+
+        return self.filter(inventory.all('guests'))
+
+
+    def __repr__(self):
+
+        return 'Selector(%r)' % self.text
@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+
+''' Command line front end for the SL API package.
+
+    Dave C. 2016
+
+    Heavy modules (SoftLayer, requests, config, hw_info) are only
+    imported by the subcommand that needs them, so `sl.py --help` and
+    cached lookups start fast.  Read commands use the local inventory
+    snapshot (inventory.py) and only delta sync it when it is older
+    than --max-age; pass --live to go to the API instead.  Fleet
+    reload and cancel always select against the live account.
+
+    /* Examples:
+    ./sl.py vm status vm-demo
+    ./sl.py --jsonl vm list --select 'dc=dal10, power=halted'
+    ./sl.py vm watch --interval 15
+    ./sl.py vm power on vm-demo
+    ./sl.py vm power off --select 'tag=Nanigans WebApp VM'
+    ./sl.py vm reload vm-demo
+    ./sl.py vm cancel --select 'tag=scratch, power=halted' --yes
+    ./sl.py --profile --trace reload.json vm reload vm-demo
+    ./sl.py vm order vm-demo webapp --verify
+    ./sl.py vm order-batch webapp web01 web02 web03 --chunk 5
+    ./sl.py image list
+    ./sl.py user find --email dave@nanigans.com
+    ./sl.py user disable 12345
+    ./sl.py apply rollout.json --workers 8
+    ./sl.py job submit reload hostname=vm-demo --priority 1
+    */ '''
+
+import sys
+import json
+import argparse
+
+
+def emit(args, result):
+    ''' Print a result, one JSON object per line with --jsonl '''
+
+    if isinstance(result, (list, tuple)):
+        items = result
+    else:
+        items = [result]
+
+    if args.jsonl:
+        for item in items:
+            if hasattr(item, 'to_dict'):
+                item = item.to_dict()
+            sys.stdout.write(json.dumps(item, sort_keys=True, default=str) + '\n')
+        return
+
+    from pprint import pprint as pp
+    for item in items:
+        pp(item)
+
+
+def get_inventory(args, kind):
+    ''' Open the local snapshot, refreshing kind if it is stale.
+        Returns None with --live. '''
+
+    if args.live:
+        return None
+
+    from inventory import Inventory
+    inv = Inventory(path=args.inventory)
+    age = inv.age(kind)
+    if age is None or age > args.max_age:
+        inv.sync([kind])
+
+    return(inv)
+
+
+# vm subcommands
+
+def vm_list(args):
+
+    if args.select:
+        from selector import Selector
+        sel = Selector(args.select)
+        inv = get_inventory(args, 'guests')
+        if inv is not None:
+            return emit(args, sel.select_inventory(inv))
+        import config
+        return emit(args, sel.select(config.client))
+
+    import vm_controls
+    emit(args, vm_controls.VmList(inventory=get_inventory(args, 'guests')).guests())
+
+
+def vm_status(args):
+
+    inv = get_inventory(args, 'guests')
+    if inv is not None:
+        return emit(args, inv.by_hostname(args.hostname))
+
+    import vm_controls
+    vm_controls.VmStatus(args.hostname).vm_status()
+
+
+def vm_watch(args):
+    ''' Stream guest state changes as JSONL until interrupted '''
+
+    from status_feed import StatusFeed, jsonl_writer
+    feed = StatusFeed(interval=args.interval, callback=jsonl_writer(sys.stdout),
+                      initial=not args.changes_only)
+    try:
+        feed.run(ticks=args.ticks)
+    except KeyboardInterrupt:
+        pass
+
+
+def vm_power(args):
+
+    import vm_controls
+
+    if args.select:
+        fleet = vm_controls.VmFleet(args.select, inventory=get_inventory(args, 'guests'))
+        action = {'on': fleet.power_on, 'off': fleet.power_off,
+                  'reboot': fleet.reboot}[args.state]
+        return emit(args, dict((k, str(v)) for k, v in action().items()))
+
+    if args.state == 'on':
+        vm_controls.VmPowerOn(args.hostname).vm_poweron()
+    elif args.state == 'off':
+        vm_controls.VmPowerOff(args.hostname).vm_poweroff()
+    else:
+        vm_controls.VmReboot(args.hostname).vm_reboot()
+
+
+def vm_reload(args):
+
+    import vm_controls
+
+    if args.select:
+        # Destructive, so match against the account now, not the snapshot
+        fleet = vm_controls.VmFleet(args.select)
+        return emit(args, dict((k, str(v)) for k, v in fleet.reload(confirm=args.yes).items()))
+
+    vm_controls.VmReload(args.hostname).vmReload()
+
+
+def vm_cancel(args):
+
+    import vm_controls
+
+    if args.select:
+        # Destructive, so match against the account now, not the snapshot
+        fleet = vm_controls.VmFleet(args.select)
+        return emit(args, dict((k, str(v)) for k, v in fleet.cancel(confirm=args.yes).items()))
+
+    vm_controls.VmCancel().cancelVm(args.hostname)
+
+
+def vm_order(args):
+
+    import vm_controls
+
+    if args.verify:
+        vm_controls.VmOrderVerify(args.hostname, args.type)
+    else:
+        vm_controls.VmOrder(args.hostname, args.type)
+
+
+def vm_order_batch(args):
+
+    import vm_controls
+
+    myBatch = vm_controls.VmOrderBatch([(h, args.type) for h in args.hostnames],
+                                       chunkSize=args.chunk, workers=args.workers)
+    if args.verify:
+        return emit(args, myBatch.verify())
+    emit(args, myBatch.run(interval=args.interval, timeout=args.timeout))
+
+
+# image subcommands
+
+def image_list(args):
+
+    import image
+
+    if args.public:
+        return emit(args, image.GetImgList().getPubImages())
+
+    emit(args, image.GetImgList(inventory=get_inventory(args, 'images')).getPriImages())
+
+
+def image_info(args):
+
+    import image
+
+    try:
+        image.GetImageInfo(int(args.image))
+    except ValueError:
+        image.GetImageInfo(args.image)
+
+
+# user subcommands
+
+def user_find(args):
+
+    inv = get_inventory(args, 'users')
+    if inv is not None:
+        if args.email:
+            return emit(args, inv.user_by_email(args.email))
+        return emit(args, inv.user_by_username(args.username))
+
+    import users
+    if args.email:
+        r = users.UserManager(email=args.email).find_user_by_email()
+    else:
+        r = users.UserManager(username=args.username).find_user_by_username()
+    emit(args, r.json())
+
+
+def user_create(args):
+
+    import users
+    users.UserManager(username=args.username, email=args.email,
+                      firstname=args.first, lastname=args.last).create_user(
+                          timezone=args.timezone)
+
+
+def user_disable(args):
+
+    import users
+    users.UserManager(sluid=args.sluid).disable_user()
+
+
+def user_perms(args):
+
+    import users
+    myInst = users.UserManager(sluid=args.sluid)
+    if args.default:
+        return myInst.set_default_portal_perms()
+    emit(args, myInst.get_user_portal_perms())
+
+
+# plan/apply against a desired-state file
+
+def plan_show(args):
+    ''' Plans always diff against the inventory; --live forces a sync '''
+
+    import plan
+    from inventory import Inventory
+
+    inv = Inventory(path=args.inventory)
+    for kind in ('guests', 'users'):
+        age = inv.age(kind)
+        if args.live or age is None or age > args.max_age:
+            inv.sync([kind])
+
+    args.checkpoint = args.checkpoint or args.state + '.ckpt'
+    myPlan = plan.Plan.build(plan.load_state(args.state), inv,
+                             plan.load_checkpoint(args.checkpoint))
+    myPlan.show()
+    return(myPlan)
+
+
+def plan_apply(args):
+
+    myPlan = plan_show(args)
+    emit(args, myPlan.apply(workers=args.workers, checkpoint=args.checkpoint))
+
+
+# job subcommands, talk to a running sld.py
+
+def job_submit(args):
+
+    import sld
+
+    params = {}
+    for pair in args.params:
+        k, _, v = pair.partition('=')
+        try:
+            params[k] = json.loads(v)
+        except ValueError:
+            params[k] = v
+    emit(args, {'id': sld.submit(args.kind, params, args.priority, args.socket)})
+
+
+def job_status(args):
+
+    import sld
+    emit(args, sld.status(args.id, args.socket))
+
+
+def job_list(args):
+
+    import sld
+    emit(args, sld.request({'op': 'jobs', 'state': args.state}, args.socket))
+
+
+def add_target(parser):
+    ''' A single hostname or --select for a fleet '''
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('hostname', nargs='?')
+    group.add_argument('--select', help='selector, see selector.py')
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(prog='sl', description='SoftLayer helpers')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='print one JSON object per line')
+    parser.add_argument('--live', action='store_true',
+                        help='skip the local inventory and ask the API')
+    parser.add_argument('--max-age', type=float, default=300,
+                        help='seconds before the inventory is delta synced (300)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print a per-step timing summary to stderr')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write OpenTelemetry (OTLP/JSON) spans to FILE')
+    parser.add_argument('--inventory', default=None,
+                        help='inventory file (~/.sl_inventory.db)')
+    sub = parser.add_subparsers(dest='group')
+
+    vm = sub.add_parser('vm').add_subparsers(dest='command')
+
+    p = vm.add_parser('list')
+    p.add_argument('--select', help='selector, see selector.py')
+    p.set_defaults(func=vm_list)
+
+    p = vm.add_parser('status')
+    p.add_argument('hostname')
+    p.set_defaults(func=vm_status)
+
+    p = vm.add_parser('watch', help='stream power state changes as JSONL')
+    p.add_argument('--interval', type=float, default=30)
+    p.add_argument('--ticks', type=int, default=None, help='stop after this many polls')
+    p.add_argument('--changes-only', action='store_true',
+                   help='do not emit the initial snapshot')
+    p.set_defaults(func=vm_watch)
+
+    p = vm.add_parser('power')
+    p.add_argument('state', choices=('on', 'off', 'reboot'))
+    add_target(p)
+    p.set_defaults(func=vm_power)
+
+    p = vm.add_parser('reload')
+    add_target(p)
+    p.add_argument('--yes', action='store_true',
+                   help='required to reload every guest matching --select')
+    p.set_defaults(func=vm_reload)
+
+    p = vm.add_parser('cancel')
+    add_target(p)
+    p.add_argument('--yes', action='store_true',
+                   help='required to cancel every guest matching --select')
+    p.set_defaults(func=vm_cancel)
+
+    p = vm.add_parser('order')
+    p.add_argument('hostname')
+    p.add_argument('type', choices=('webapp', 'minimal'))
+    p.add_argument('--verify', action='store_true', help='verify only, no charge')
+    p.set_defaults(func=vm_order)
+
+    p = vm.add_parser('order-batch', help='order many, wait for all to provision')
+    p.add_argument('type', choices=('webapp', 'minimal'))
+    p.add_argument('hostnames', nargs='+')
+    p.add_argument('--verify', action='store_true', help='verify only, no charge')
+    p.add_argument('--chunk', type=int, default=10, help='orders per request (10)')
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('--interval', type=float, default=30, help='poll seconds (30)')
+    p.add_argument('--timeout', type=float, default=None, help='stop waiting after seconds')
+    p.set_defaults(func=vm_order_batch)
+
+    image = sub.add_parser('image').add_subparsers(dest='command')
+
+    p = image.add_parser('list')
+    p.add_argument('--public', action='store_true')
+    p.set_defaults(func=image_list)
+
+    p = image.add_parser('info')
+    p.add_argument('image', help='image id or name')
+    p.set_defaults(func=image_info)
+
+    user = sub.add_parser('user').add_subparsers(dest='command')
+
+    p = user.add_parser('find')
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--email')
+    group.add_argument('--username')
+    p.set_defaults(func=user_find)
+
+    p = user.add_parser('create')
+    p.add_argument('--username', required=True)
+    p.add_argument('--email', required=True)
+    p.add_argument('--first', required=True)
+    p.add_argument('--last', required=True)
+    p.add_argument('--timezone', default='America/New_York',
+                   help='SL timezone name or id (America/New_York)')
+    p.set_defaults(func=user_create)
+
+    p = user.add_parser('disable')
+    p.add_argument('sluid')
+    p.set_defaults(func=user_disable)
+
+    p = user.add_parser('perms')
+    p.add_argument('sluid')
+    p.add_argument('--default', action='store_true',
+                   help='apply default portal perms instead of listing')
+    p.set_defaults(func=user_perms)
+
+    p = sub.add_parser('plan', help='show what apply would do')
+    p.add_argument('state', help='desired-state JSON file, see plan.py')
+    p.add_argument('--checkpoint', help='progress file (STATE.ckpt)')
+    p.set_defaults(func=plan_show)
+
+    p = sub.add_parser('apply', help='apply a desired-state file')
+    p.add_argument('state', help='desired-state JSON file, see plan.py')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--checkpoint', help='progress file (STATE.ckpt)')
+    p.set_defaults(func=plan_apply)
+
+    job = sub.add_parser('job').add_subparsers(dest='command')
+
+    p = job.add_parser('submit')
+    p.add_argument('kind', help='power_on, reload, user_disable, ... see sld.py')
+    p.add_argument('params', nargs='*', help='key=value, values parsed as JSON if they can be')
+    p.add_argument('--priority', type=int, default=5, help='lower runs first (5)')
+    p.set_defaults(func=job_submit)
+
+    p = job.add_parser('status')
+    p.add_argument('id', type=int)
+    p.set_defaults(func=job_status)
+
+    p = job.add_parser('list')
+    p.add_argument('--state', choices=('queued', 'running', 'done', 'failed'))
+    p.set_defaults(func=job_list)
+
+    for p in (job.choices['submit'], job.choices['status'], job.choices['list']):
+        p.add_argument('--socket', default=None, help='sld socket (~/.sld.sock)')
+
+    return(parser)
+
+
+def main(argv=None):
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not hasattr(args, 'func'):
+        parser.print_help()
+        return 2
+
+    if args.inventory is None:
+        from inventory import DEFAULT_PATH
+        args.inventory = DEFAULT_PATH
+    if getattr(args, 'socket', '') is None:
+        from sld import DEFAULT_SOCKET
+        args.socket = DEFAULT_SOCKET
+
+    if args.profile or args.trace:
+        import tracing
+        tracing.enable()
+        try:
+            with tracing.span('sl %s %s' % (args.group, getattr(args, 'command', '') or '')):
+                args.func(args)
+        finally:
+            if args.trace:
+                tracing.export(args.trace)
+            if args.profile:
+                tracing.summary()
+        return 0
+
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
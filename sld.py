@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+''' Long running job daemon for the SL API package.
+
+    Dave C. 2016
+
+    Instead of a fresh script per action (re-import, rebuild the
+    client, re-download the guest list) the daemon keeps one warm
+    client, the local inventory and a persistent job queue.  Jobs are
+    submitted over a Unix socket as one JSON object per line and run
+    by a fixed pool of workers, lowest priority number first, with a
+    per-kind cap on how many of one kind run at once.
+
+    Protocol (one request line, one reply line):
+
+        {"op": "submit", "kind": "power_on", "params": {"hostname": "vm-demo"}, "priority": 5}
+            -> {"id": 12}
+        {"op": "submit", "kind": "cancel", "params": {"select": "tag=scratch", "confirm": true}}
+            -> {"id": 13}     fleet reload and cancel need "confirm": true
+        {"op": "status", "id": 12}   -> {"id": 12, "state": "done", ...}
+        {"op": "jobs", "state": "queued"} -> [{...}, ...]
+        {"op": "ping"}               -> {"ok": true}
+
+    Job states are queued, running, done, failed, and interrupted
+    for jobs that were running when the daemon stopped.  Those are not
+    rerun on start up; check them with "jobs" and resubmit by hand.
+
+    /* Example:
+    ./sld.py --workers 8                          # start the daemon
+    ./sld.py --account qa --socket ~/.sld.qa.sock --jobs ~/.sld_jobs.qa.db
+    ./sl.py job submit power_on hostname=vm-demo   # from anywhere
+    ./sl.py job status 12
+    */ '''
+
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+
+try:
+    import Queue as queue
+    import SocketServer as socketserver
+except ImportError:
+    import queue
+    import socketserver
+
+
+DEFAULT_SOCKET = os.path.expanduser('~/.sld.sock')
+DEFAULT_JOBS = os.path.expanduser('~/.sld_jobs.db')
+
+
+# Handlers. Each takes the job params and the daemon; heavy modules
+# are already imported by the time a worker calls one.
+
+def _fleet_or_host(daemon, params, fleetAction, hostAction, confirm=False):
+
+    import vm_controls
+
+    if params.get('select'):
+        # Reload and cancel (the ones needing confirm) select against
+        # the live account; the snapshot may be a refresh behind.
+        inventory = None if confirm else daemon.inventory
+        fleet = vm_controls.VmFleet(params['select'], inventory=inventory,
+                                    account=daemon.account)
+        kwargs = {'confirm': bool(params.get('confirm'))} if confirm else {}
+        return dict((k, str(v)) for k, v in getattr(fleet, fleetAction)(**kwargs).items())
+
+    return hostAction(vm_controls, params['hostname'], daemon.account)
+
+
+def power_on(daemon, params):
+
+    return _fleet_or_host(daemon, params, 'power_on',
+                          lambda vc, h, a: vc.VmPowerOn(h, account=a).vm_poweron())
+
+
+def power_off(daemon, params):
+
+    return _fleet_or_host(daemon, params, 'power_off',
+                          lambda vc, h, a: vc.VmPowerOff(h, account=a).vm_poweroff())
+
+
+def reboot(daemon, params):
+
+    return _fleet_or_host(daemon, params, 'reboot',
+                          lambda vc, h, a: vc.VmReboot(h, account=a).vm_reboot())
+
+
+def reload(daemon, params):
+
+    return _fleet_or_host(daemon, params, 'reload',
+                          lambda vc, h, a: vc.VmReload(h, account=a).vmReload(), confirm=True)
+
+
+def cancel(daemon, params):
+
+    return _fleet_or_host(daemon, params, 'cancel',
+                          lambda vc, h, a: vc.VmCancel(account=a).cancelVm(h), confirm=True)
+
+
+def user_disable(daemon, params):
+
+    import users
+    return users.UserManager(sluid=params['sluid'], account=daemon.account).disable_user()
+
+
+def user_vpn(daemon, params):
+
+    import users
+    return users.UserManager(sluid=params['sluid'], account=daemon.account).set_user_vpn_status(
+        ssl=params.get('ssl'), pptp=params.get('pptp'))
+
+
+def user_vpn_password(daemon, params):
+
+    import users
+    return users.UserManager(sluid=params['sluid'], account=daemon.account).set_user_vpn_password(
+        myPass=params['password'])
+
+
+def user_default_perms(daemon, params):
+
+    import users
+    return users.UserManager(sluid=params['sluid'],
+                             account=daemon.account).set_default_portal_perms()
+
+
+def inventory_sync(daemon, params):
+
+    return daemon.inventory.sync(params.get('kinds'), full=params.get('full', False))
+
+
+HANDLERS = {
+    'power_on':           power_on,
+    'power_off':          power_off,
+    'reboot':             reboot,
+    'reload':             reload,
+    'cancel':             cancel,
+    'user_disable':       user_disable,
+    'user_vpn':           user_vpn,
+    'user_vpn_password':  user_vpn_password,
+    'user_default_perms': user_default_perms,
+    'inventory_sync':     inventory_sync,
+}
+
+# Most jobs of one kind allowed to run at once; others use --workers
+KIND_LIMITS = {
+    'reload': 2,
+    'cancel': 1,
+    'inventory_sync': 1,
+}
+
+
+class JobStore(object):
+    ''' SQLite job table so queued work survives a restart '''
+
+    def __init__(self, path=DEFAULT_JOBS):
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs '
+                        '(id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, params TEXT, '
+                        'priority INTEGER, state TEXT, result TEXT, error TEXT, '
+                        'submitted REAL, started REAL, finished REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+        self.db.commit()
+
+
+    def add(self, kind, params, priority):
+
+        with self.lock:
+            cur = self.db.execute('INSERT INTO jobs (kind, params, priority, state, submitted) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  (kind, json.dumps(params), priority, 'queued', time.time()))
+            self.db.commit()
+        return(cur.lastrowid)
+
+
+    def update(self, id, **fields):
+
+        cols = sorted(fields)
+        with self.lock:
+            self.db.execute('UPDATE jobs SET %s WHERE id = ?'
+                            % ', '.join('%s = ?' % c for c in cols),
+                            [fields[c] for c in cols] + [id])
+            self.db.commit()
+
+
+    def get(self, id):
+
+        rows = self.find('WHERE id = ?', (id,))
+        return rows[0] if rows else None
+
+
+    def find(self, where='', args=()):
+
+        with self.lock:
+            cur = self.db.execute('SELECT * FROM jobs %s ORDER BY id' % where, args)
+            names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+
+        jobs = []
+        for row in rows:
+            job = dict(zip(names, row))
+            job['params'] = json.loads(job['params'])
+            jobs.append(job)
+        return(jobs)
+
+
+    def pending(self):
+        ''' Jobs to requeue at start up.  Anything left running by a
+            crash is marked interrupted instead: it may have got as far
+            as a reload, cancel or order, so running it again is left
+            to the operator. '''
+
+        with self.lock:
+            self.db.execute("UPDATE jobs SET state = 'interrupted', finished = ?, "
+                            "error = 'daemon stopped while running, resubmit if needed' "
+                            "WHERE state = 'running'", (time.time(),))
+            self.db.commit()
+        return self.find("WHERE state = 'queued'")
+
+
+class Daemon(object):
+    ''' Warm client, inventory and worker pool behind the socket.
+        Every job runs against account (the default one if None). '''
+
+    def __init__(self, workers=4, jobs=DEFAULT_JOBS, inventory=None, refresh=300,
+                 account=None):
+
+        # Pay the import and connection cost once, up front
+        import accounts
+        import vm_controls
+        import users
+        from inventory import Inventory
+
+        self.account = accounts.resolve(account)
+        self.client = self.account.client
+        self.inventory = Inventory(client=self.client, path=inventory,
+                                   account=self.account)
+        self.refresh = refresh
+        self.store = JobStore(jobs)
+        self.queue = queue.PriorityQueue()
+        self.seq = 0
+        self.seqLock = threading.Lock()
+        # Running count per capped kind, and jobs parked while it is full
+        self.limitLock = threading.Lock()
+        self.active = dict((k, 0) for k in KIND_LIMITS)
+        self.deferred = dict((k, []) for k in KIND_LIMITS)
+        self.stopping = threading.Event()
+
+        for job in self.store.pending():
+            self._enqueue(job['id'], job['priority'])
+
+        self.threads = [threading.Thread(target=self._worker, name='sld-worker-%d' % i)
+                        for i in range(workers)]
+        self.threads.append(threading.Thread(target=self._refresher, name='sld-refresh'))
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+
+    def _enqueue(self, id, priority):
+
+        with self.seqLock:
+            self.seq += 1
+            self.queue.put((priority, self.seq, id))
+
+
+    def submit(self, kind, params, priority=5):
+
+        if kind not in HANDLERS:
+            raise ValueError('Unknown job kind %s' % kind)
+
+        id = self.store.add(kind, params, priority)
+        self._enqueue(id, priority)
+        return(id)
+
+
+    def _worker(self):
+
+        while not self.stopping.is_set():
+            try:
+                priority, seq, id = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            job = self.store.get(id)
+            kind = job['kind']
+            capped = kind in KIND_LIMITS
+            if capped:
+                with self.limitLock:
+                    if self.active[kind] >= KIND_LIMITS[kind]:
+                        # Kind is at its cap; park it until a slot frees
+                        heapq.heappush(self.deferred[kind], (priority, seq, id))
+                        continue
+                    self.active[kind] += 1
+
+            try:
+                self._run(job)
+            finally:
+                if capped:
+                    self._release(kind)
+
+
+    def _release(self, kind):
+        ''' Free a slot of kind and hand its best parked job back to
+            the queue, keeping its place in line '''
+
+        with self.limitLock:
+            self.active[kind] -= 1
+            if self.deferred[kind]:
+                self.queue.put(heapq.heappop(self.deferred[kind]))
+
+
+    def _run(self, job):
+
+        self.store.update(job['id'], state='running', started=time.time())
+        try:
+            result = HANDLERS[job['kind']](self, job['params'])
+            self.store.update(job['id'], state='done', finished=time.time(),
+                              result=json.dumps(result, default=str))
+        except Exception as e:
+            traceback.print_exc()
+            self.store.update(job['id'], state='failed', finished=time.time(),
+                              error='%s: %s' % (type(e).__name__, e))
+
+
+    def _refresher(self):
+        ''' Keep the inventory warm so fleet jobs resolve locally '''
+
+        while not self.stopping.is_set():
+            try:
+                self.inventory.sync()
+            except Exception:
+                traceback.print_exc()
+            self.stopping.wait(self.refresh)
+
+
+    def handle(self, request):
+        ''' Answer one protocol request '''
+
+        op = request.get('op')
+        if op == 'submit':
+            return {'id': self.submit(request['kind'], request.get('params', {}),
+                                      request.get('priority', 5))}
+        if op == 'status':
+            return self.store.get(request['id'])
+        if op == 'jobs':
+            if request.get('state'):
+                return self.store.find('WHERE state = ?', (request['state'],))
+            return self.store.find()
+        if op == 'ping':
+            return {'ok': True, 'queued': self.queue.qsize()}
+
+        raise ValueError('Unknown op %s' % op)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        for line in self.rfile:
+            try:
+                reply = self.server.daemon.handle(json.loads(line.decode('utf-8')))
+            except Exception as e:
+                reply = {'error': '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write((json.dumps(reply, default=str) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+
+def serve(daemon, path=DEFAULT_SOCKET):
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = _Server(path, _Handler)
+    server.daemon = daemon
+    os.chmod(path, 0o600)
+    try:
+        server.serve_forever()
+    finally:
+        daemon.stopping.set()
+        os.unlink(path)
+
+
+def request(payload, path=DEFAULT_SOCKET):
+    ''' Send one request to a running daemon and return the reply '''
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        s.sendall((json.dumps(payload) + '\n').encode('utf-8'))
+        f = s.makefile('rb')
+        reply = json.loads(f.readline().decode('utf-8'))
+    finally:
+        s.close()
+
+    if isinstance(reply, dict) and 'error' in reply and len(reply) == 1:
+        raise RuntimeError(reply['error'])
+    return(reply)
+
+
+def submit(kind, params, priority=5, path=DEFAULT_SOCKET):
+
+    return request({'op': 'submit', 'kind': kind, 'params': params,
+                    'priority': priority}, path)['id']
+
+
+def status(id, path=DEFAULT_SOCKET):
+
+    return request({'op': 'status', 'id': id}, path)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='sld', description='SL job daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--jobs', default=DEFAULT_JOBS, help='job database')
+    parser.add_argument('--inventory', default=None, help='inventory file')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--refresh', type=float, default=300,
+                        help='seconds between inventory delta syncs')
+    parser.add_argument('--account', default=None,
+                        help='account name from ~/.sl_accounts.json (default: config)')
+    args = parser.parse_args(argv)
+
+    account = None
+    if args.account:
+        import accounts
+        account = accounts.AccountSet.from_file()[args.account]
+
+    daemon = Daemon(workers=args.workers, jobs=args.jobs, inventory=args.inventory,
+                    refresh=args.refresh, account=account)
+    print("sld listening on %s" % args.socket)
+    serve(daemon, args.socket)
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,144 @@
+''' This file is part of the SL API package and holds the guest
+    status feed used to watch power state across the fleet.
+
+    Each tick makes one getVirtualGuests call with a minimal mask
+    (id, hostname, powerState, activeTransaction, provisionDate),
+    compares it to the previous tick and emits only what changed:
+
+        added    guest appeared (every guest on the first tick)
+        removed  guest is gone
+        changed  powerState, activeTransaction, provisionDate or
+                 hostname moved; 'was' holds the old values
+
+    Events are dicts handed to a callback.  jsonl_writer gives a
+    callback that writes one JSON object per line.
+
+    /* Example:
+    feed = StatusFeed(callback=jsonl_writer(sys.stdout), interval=30)
+    feed.run()                      # forever
+
+    feed = StatusFeed()
+    events = feed.poll()            # one tick, returns the events
+    */ '''
+
+import sys
+import json
+import time
+from records import VirtualGuest
+
+
+MASK = ('mask[id,hostname,provisionDate,powerState[keyName],'
+        'activeTransaction[transactionStatus[name]]]')
+
+_WATCHED = ('hostname', 'powerState', 'activeTransaction', 'provisionDate')
+
+
+def jsonl_writer(stream=sys.stdout):
+
+    def write(event):
+        stream.write(json.dumps(event, sort_keys=True) + '\n')
+        stream.flush()
+    return write
+
+
+class StatusFeed(object):
+    ''' Polls the account and emits guest state change events '''
+
+    def __init__(self, client=None, interval=30, callback=None, initial=True,
+                 account=None):
+
+        if client is None:
+            import accounts
+            client = accounts.resolve(account).client
+        self.client = client
+        self.interval = interval
+        self.callbacks = [callback] if callback else []
+        self.initial = initial
+        self.state = None
+
+
+    def subscribe(self, callback):
+
+        self.callbacks.append(callback)
+
+
+    def unsubscribe(self, callback):
+
+        self.callbacks.remove(callback)
+
+
+    def snapshot(self):
+        ''' {id: (hostname, powerState, activeTransaction, provisionDate)} now '''
+
+        guests = self.client['SoftLayer_Account'].getVirtualGuests(mask=MASK)
+        current = {}
+        for g in guests:
+            g = VirtualGuest.from_api(g)
+            current[g.id] = (g.hostname, g.powerState, g.activeTransaction,
+                             g.provisionDate)
+
+        return(current)
+
+
+    def poll(self, current=None):
+        ''' One tick. Returns the events it emitted.  current is a
+            snapshot() already taken, if any. '''
+
+        now = time.time()
+        if current is None:
+            current = self.snapshot()
+        previous = self.state
+        self.state = current
+        events = []
+
+        if previous is None:
+            if self.initial:
+                for id, values in sorted(current.items()):
+                    events.append(self._event(now, 'added', id, values))
+        else:
+            for id, values in sorted(current.items()):
+                old = previous.get(id)
+                if old is None:
+                    events.append(self._event(now, 'added', id, values))
+                elif old != values:
+                    event = self._event(now, 'changed', id, values)
+                    event['was'] = dict((k, o) for k, o, n in zip(_WATCHED, old, values)
+                                        if o != n)
+                    events.append(event)
+            for id in sorted(set(previous) - set(current)):
+                events.append(self._event(now, 'removed', id, previous[id]))
+
+        for event in events:
+            for callback in self.callbacks:
+                callback(event)
+
+        return(events)
+
+
+    def _event(self, now, kind, id, values):
+
+        event = {'time': now, 'event': kind, 'id': id}
+        event.update(zip(_WATCHED, values))
+        return(event)
+
+
+    def run(self, ticks=None):
+        ''' Poll every interval seconds, ticks times or forever.  A
+            tick whose listing fails is logged to stderr and skipped;
+            the next one diffs against the last good snapshot. '''
+
+        done = 0
+        while ticks is None or done < ticks:
+            started = time.time()
+            try:
+                current = self.snapshot()
+            except Exception as e:
+                # SoftLayerAPIError, connection errors and the like
+                sys.stderr.write('status poll failed, skipping tick: %s: %s\n'
+                                 % (type(e).__name__, e))
+                sys.stderr.flush()
+            else:
+                self.poll(current)
+            done += 1
+            if ticks is None or done < ticks:
+                time.sleep(max(0, self.interval - (time.time() - started)))
@@ -0,0 +1,311 @@
+''' This file is part of the SL API package and holds the tracing
+    hooks used to see where multi-step operations spend their time.
+
+    Code wraps each logical step and each API call in a span.  Spans
+    nest per thread, record their duration and any attributes we set
+    (endpoint, retries, payload bytes, errors), and can be exported
+    as OpenTelemetry (OTLP/JSON) for any OTel aware viewer, or folded
+    into a per-step summary table.
+
+    Work handed to a thread pool is wrapped with bind(), which
+    carries the submitting thread's open span over so the worker's
+    spans nest under it instead of starting their own trace.
+
+    Tracing is off until enable() is called, and span() is then a
+    cheap no-op.  Setting SL_TRACE=/path/file.json turns it on and
+    writes the export at exit.
+
+    /* Example:
+    tracing.enable()
+    with tracing.span('vm.reload', hostname='vm-demo'):
+        with tracing.span('lookup'):
+            ...
+    with tracing.span('bulk'):
+        pool.map(tracing.bind(work), items)
+    tracing.export('trace.json')
+    tracing.summary()
+    */ '''
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import threading
+
+
+class Span(object):
+
+    __slots__ = ('traceId', 'spanId', 'parentId', 'name', 'start', 'end',
+                 'attributes', 'error')
+
+    def __init__(self, name, traceId, parentId, attributes):
+
+        self.name = name
+        self.traceId = traceId
+        self.spanId = '%016x' % random.getrandbits(64)
+        self.parentId = parentId
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+
+    def set(self, key, value):
+
+        self.attributes[key] = value
+
+
+    @property
+    def duration(self):
+
+        return (self.end or time.time()) - self.start
+
+
+class _NoSpan(object):
+    ''' Stand in when tracing is off '''
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOSPAN = _NoSpan()
+
+
+class _SpanContext(object):
+
+    def __init__(self, tracer, name, attributes):
+
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+
+    def __enter__(self):
+
+        self.span = self.tracer._start(self.name, self.attributes)
+        return self.span
+
+
+    def __exit__(self, excType, exc, tb):
+
+        if exc is not None:
+            self.span.error = '%s: %s' % (excType.__name__, exc)
+        self.tracer._finish(self.span)
+        return False
+
+
+class Tracer(object):
+
+    def __init__(self):
+
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = []
+
+
+    def span(self, name, **attributes):
+
+        if not self.enabled:
+            return _NOSPAN
+        return _SpanContext(self, name, attributes)
+
+
+    def _stack(self):
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return(stack)
+
+
+    def current(self):
+        ''' The innermost open span on this thread, or None '''
+
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+
+    def bind(self, fn):
+        ''' fn wrapped to run under this thread's current span when
+            called on another thread, e.g. by a ThreadPool worker '''
+
+        parent = self.current() if self.enabled else None
+        if parent is None:
+            return fn
+
+        def run(*args, **kwargs):
+            stack = self._stack()
+            stack.append(parent)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stack.pop()
+        return run
+
+
+    def _start(self, name, attributes):
+
+        stack = self._stack()
+
+        if stack:
+            parent = stack[-1]
+            span = Span(name, parent.traceId, parent.spanId, attributes)
+        else:
+            span = Span(name, '%032x' % random.getrandbits(128), None, attributes)
+
+        stack.append(span)
+        return(span)
+
+
+    def _finish(self, span):
+
+        span.end = time.time()
+        self.local.stack.pop()
+        with self.lock:
+            self.spans.append(span)
+
+
+    def reset(self):
+
+        with self.lock:
+            self.spans = []
+
+
+    def otlp(self):
+        ''' Finished spans as an OTLP/JSON ExportTraceServiceRequest '''
+
+        with self.lock:
+            spans = list(self.spans)
+
+        out = []
+        for s in spans:
+            d = {
+                'traceId': s.traceId,
+                'spanId': s.spanId,
+                'name': s.name,
+                'kind': 1,
+                'startTimeUnixNano': str(int(s.start * 1e9)),
+                'endTimeUnixNano': str(int(s.end * 1e9)),
+                'attributes': [_attribute(k, v) for k, v in sorted(s.attributes.items())],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+            }
+            if s.parentId:
+                d['parentSpanId'] = s.parentId
+            out.append(d)
+
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', 'sl')]},
+            'scopeSpans': [{'scope': {'name': 'sl'}, 'spans': out}]}]}
+
+
+    def export(self, path):
+
+        with open(path, 'w') as f:
+            json.dump(self.otlp(), f, indent=1)
+
+
+    def summary(self, stream=sys.stderr):
+        ''' Table of span names by total time, with self time (time
+            not covered by any child span) so the slow step stands out.
+            Children running in parallel are counted once. '''
+
+        with self.lock:
+            spans = list(self.spans)
+
+        intervals = {}
+        for s in spans:
+            if s.parentId:
+                intervals.setdefault(s.parentId, []).append((s.start, s.end))
+        children = dict((id, _covered(i)) for id, i in intervals.items())
+
+        rows = {}
+        for s in spans:
+            row = rows.setdefault(s.name, [0, 0.0, 0.0, 0.0, 0])
+            row[0] += 1
+            row[1] += s.duration
+            row[2] += max(0.0, s.duration - children.get(s.spanId, 0))
+            row[3] = max(row[3], s.duration)
+            row[4] += 1 if s.error else 0
+
+        stream.write('%-50s %6s %10s %10s %10s %6s\n' % (
+            'span', 'count', 'total s', 'self s', 'max s', 'errors'))
+        for name, row in sorted(rows.items(), key=lambda r: -r[1][1]):
+            stream.write('%-50s %6d %10.3f %10.3f %10.3f %6d\n' % (
+                name[:50], row[0], row[1], row[2], row[3], row[4]))
+
+
+def _covered(intervals):
+    ''' Total length of the union of (start, end) intervals '''
+
+    total = 0.0
+    end = None
+    for s, e in sorted(intervals):
+        if end is None or s > end:
+            total += e - s
+            end = e
+        elif e > end:
+            total += e - end
+            end = e
+
+    return(total)
+
+
+def _attribute(key, value):
+
+    if isinstance(value, bool):
+        v = {'boolValue': value}
+    elif isinstance(value, int):
+        v = {'intValue': str(value)}
+    elif isinstance(value, float):
+        v = {'doubleValue': value}
+    else:
+        v = {'stringValue': str(value)}
+
+    return {'key': key, 'value': v}
+
+
+def payload_size(obj):
+    ''' Rough size in bytes of an API result or requests Response.
+        Only call this when tracing is on. '''
+
+    content = getattr(obj, 'content', None)
+    if content is not None:
+        return len(content)
+    try:
+        return len(json.dumps(obj, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+tracer = Tracer()
+span = tracer.span
+bind = tracer.bind
+export = tracer.export
+summary = tracer.summary
+
+
+def enabled():
+
+    return tracer.enabled
+
+
+def enable(path=None):
+    ''' Turn tracing on.  With a path the OTLP export is written
+        there when the process exits. '''
+
+    tracer.enabled = True
+    if path:
+        atexit.register(tracer.export, path)
+
+
+if os.environ.get('SL_TRACE'):
+    enable(os.environ['SL_TRACE'])
@@ -18,20 +18,69 @@ import os
 import sys
 import time
 import SoftLayer
-import config
+import accounts
+import coalesce
+import resilience
+import tracing
+from records import VirtualGuest
+from selector import Selector
+from status_feed import StatusFeed
+from multiprocessing.pool import ThreadPool
 from pprint import pprint as pp
 
 
 class VmConnector(object):
     ''' This class is responsible for building the 
-        client connection to SoftLayer '''
+        client connection to SoftLayer. Every subclass takes
+        account= (see accounts.py); left out we use config. '''
 
-    def __init__(self):
+    def __init__(self, account=None):
 
-        self.client = config.client
+        self.account = accounts.resolve(account)
+        self.client = self.account.client
         self.mgr = SoftLayer.VSManager(self.client)
 
 
+    def get_virtual_guests(self):
+        ''' Get all virtual guests on the account. Concurrent
+            callers share one in-flight request. '''
+
+        key = coalesce.make_key('SoftLayer_Account', 'getVirtualGuests', account=self.account.name)
+        with tracing.span('api SoftLayer_Account::getVirtualGuests') as sp:
+            virtualGuests = coalesce.flight.do(key, self.client['SoftLayer_Account'].getVirtualGuests)
+            if tracing.enabled():
+                sp.set('payload.bytes', tracing.payload_size(virtualGuests))
+        return(virtualGuests)
+
+
+    def find_guest_id(self, virtualGuestName):
+        ''' Look up a guest id by hostname. None if the listing fails
+            or there is no such guest. '''
+
+        try:
+            # Get all virtual guests that the account has:
+            virtualGuests = self.get_virtual_guests()
+
+        except SoftLayer.SoftLayerAPIError as e:
+            print("Unable to retrieve virtual guest list.")
+            return None
+
+        # Looking for the virtual guest
+        for virtualGuest in virtualGuests:
+            if virtualGuest['hostname'] == virtualGuestName:
+                print("VM name is %s and id is %s" % (virtualGuestName, virtualGuest['id']))
+                return virtualGuest['id']
+
+        print("No VM named %s" % virtualGuestName)
+        return None
+
+
+    def power_state(self, virtualGuestId):
+        ''' Current powerState keyName, e.g. RUNNING or HALTED '''
+
+        return self.client['SoftLayer_Virtual_Guest'].getPowerState(id=virtualGuestId)['keyName']
+
+
 class VmPowerOn(VmConnector):
     ''' This class powers on a designated VM passed in
 
@@ -43,35 +92,32 @@ class VmPowerOn(VmConnector):
     */ ''' 
 
 
-    def __init__(self,virtualGuestName):
+    def __init__(self,virtualGuestName, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.virtualGuestName = virtualGuestName
 
 
     def vm_poweron(self):
 
-        try:
-            # Get all virtual guests that the account has:
-            virtualGuests = self.client['SoftLayer_Account'].getVirtualGuests()
-
-        except SoftLayer.SoftLayerAPIError as e:
-            print("Unable to retrieve virtual list")
-
-
-        # Looking for the virtual guest
-        self.virtualGuestId = ''
-        for virtualGuest in virtualGuests:
-            if virtualGuest['hostname'] == self.virtualGuestName:
-                self.virtualGuestId = virtualGuest['id']
-                print("VM name is %s and id is %s" % (self.virtualGuestName,self.virtualGuestId))
+        self.virtualGuestId = self.find_guest_id(self.virtualGuestName)
+        if self.virtualGuestId is None:
+            return
 
         try:
-            # Power on the virtual guest
-            virtualMachines = self.client['SoftLayer_Virtual_Guest'].powerOn(id=self.virtualGuestId)
-            print ("%s powered on" % self.virtualGuestName)
+            # Power on the virtual guest unless it is already running
+            virtualMachines = resilience.call(
+                'SoftLayer_Virtual_Guest::powerOn',
+                self.client['SoftLayer_Virtual_Guest'].powerOn,
+                kwargs={'id': self.virtualGuestId},
+                done=lambda: self.power_state(self.virtualGuestId) == 'RUNNING',
+                account=self.account.name)
+            if virtualMachines is resilience.SKIPPED:
+                print("%s is already running" % self.virtualGuestName)
+            else:
+                print ("%s powered on" % self.virtualGuestName)
 
-        except SoftLayer.SoftLayerAPIError as e:
+        except (SoftLayer.SoftLayerAPIError, resilience.CircuitOpenError) as e:
             print("Unable to power on %s" % self.virtualGuestName)
 
 
@@ -87,35 +133,32 @@ class VmPowerOff(VmConnector):
     */ ''' 
 
 
-    def __init__(self,virtualGuestName):
+    def __init__(self,virtualGuestName, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.virtualGuestName = virtualGuestName
 
 
     def vm_poweroff(self):
 
-        try:
-            # Get all virtual guests that the account has:
-            virtualGuests = self.client['SoftLayer_Account'].getVirtualGuests()
-
-        except SoftLayer.SoftLayerAPIError as e:
-            print("Unable to retrieve virtual list")
-
-
-        # Looking for the virtual guest
-        self.virtualGuestId = ''
-        for virtualGuest in virtualGuests:
-            if virtualGuest['hostname'] == self.virtualGuestName:
-                self.virtualGuestId = virtualGuest['id']
-                print("VM name is %s and id is %s" % (self.virtualGuestName,self.virtualGuestId))
+        self.virtualGuestId = self.find_guest_id(self.virtualGuestName)
+        if self.virtualGuestId is None:
+            return
 
         try:
-            # Power off the virtual guest
-            virtualMachines = self.client['SoftLayer_Virtual_Guest'].powerOff(id=self.virtualGuestId)
-            print ("%s powered off" % self.virtualGuestName)
+            # Power off the virtual guest unless it is already halted
+            virtualMachines = resilience.call(
+                'SoftLayer_Virtual_Guest::powerOff',
+                self.client['SoftLayer_Virtual_Guest'].powerOff,
+                kwargs={'id': self.virtualGuestId},
+                done=lambda: self.power_state(self.virtualGuestId) == 'HALTED',
+                account=self.account.name)
+            if virtualMachines is resilience.SKIPPED:
+                print("%s is already powered off" % self.virtualGuestName)
+            else:
+                print ("%s powered off" % self.virtualGuestName)
 
-        except SoftLayer.SoftLayerAPIError as e:
+        except (SoftLayer.SoftLayerAPIError, resilience.CircuitOpenError) as e:
             print("unable to power off %s" % self.virtualGuestName)
 
 
@@ -129,60 +172,75 @@ class VmReboot(VmConnector):
     */'''
 
 
-    def __init__(self,virtualGuestName):
+    def __init__(self,virtualGuestName, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.virtualGuestName = virtualGuestName
 
 
     def vm_reboot(self):
 
-        try:
-            # Getting all virtual guest that the account has:
-            virtualGuests = self.client['SoftLayer_Account'].getVirtualGuests()
-
-        except SoftLayer.SoftLayerAPIError as e:
-            print("Unable to retrieve virtual guest list.")
-
-
-        # Looking for the virtual guest
-        virtualGuestId = ''
-        for virtualGuest in virtualGuests:
-            if virtualGuest['hostname'] == self.virtualGuestName:
-                self.virtualGuestId = virtualGuest['id']
-
+        self.virtualGuestId = self.find_guest_id(self.virtualGuestName)
+        if self.virtualGuestId is None:
+            return
 
-        # Reboot the Virtual Guest
+        # Reboot the Virtual Guest. The key stops a double submitted
+        # call in this process rebooting it twice within two minutes.
         try:
 
-            result = self.client['Virtual_Guest'].rebootDefault(id=self.virtualGuestId)
-            pp(result)
+            result = resilience.call(
+                'SoftLayer_Virtual_Guest::rebootDefault',
+                self.client['Virtual_Guest'].rebootDefault,
+                kwargs={'id': self.virtualGuestId},
+                key=('rebootDefault', self.virtualGuestId),
+                account=self.account.name)
+            if result is resilience.SKIPPED:
+                print("%s was just rebooted, not rebooting again" % self.virtualGuestName)
+            else:
+                pp(result)
 
-        except SoftLayer.SoftLayerAPIError as e:
+        except (SoftLayer.SoftLayerAPIError, resilience.CircuitOpenError) as e:
             print("Unable to reboot %s" % self.virtualGuestName)
 
 
 
 class VmList(VmConnector):
-    ''' This class returns a list of all VM's currently in use by Nanigans
+    ''' This class returns a list of all VM's currently in use by Nanigans.
+        Pass an inventory.Inventory to read the local snapshot instead
+        of downloading the account list.
 
     /* Example:
 
-    vm = 'vm-demo'
-    toggle_vm = VmPowerOn(vm)
-    vm_status = toggle_vm.vm_poweron()
+    myList = VmList()
+    myList.vm_list()
+
+    myList = VmList(inventory=Inventory())     # offline
+    myList.vm_list()
     */ '''
 
 
-    def __init__(self):
+    def __init__(self, inventory=None, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.mgr = SoftLayer.VSManager(self.client)
+        if inventory is not None:
+            inventory.check_account(self.account)
+        self.inventory = inventory
+
+
+    def guests(self):
+        ''' All guests on the account as compact VirtualGuest records '''
+
+        if self.inventory is not None:
+            return self.inventory.all('guests')
+
+        return [VirtualGuest.from_api(g) for g in
+                self.mgr.list_instances(mask=VirtualGuest.mask)]
 
 
     def vm_list(self):
 
-        result =  self.mgr.list_instances()
+        result = self.guests()
         pp(result)
 
 
@@ -196,9 +254,9 @@ class VmStatus(VmConnector):
     vm_status = toggle_vm.vm_status()
     */  '''
 
-    def __init__(self,virtualGuestName):
+    def __init__(self,virtualGuestName, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.virtualGuestName = virtualGuestName
 
 
@@ -206,7 +264,7 @@ class VmStatus(VmConnector):
 
         try:
             # Getting all virtual guest that the account has:
-            virtualGuests = self.client['SoftLayer_Account'].getVirtualGuests()
+            virtualGuests = self.get_virtual_guests()
 
         except SoftLayer.SoftLayerAPIError as e:
             print("Unable to retrieve virtual guest list.")
@@ -228,7 +286,9 @@ class VmStatus(VmConnector):
         self.vmId = vmId
 
         while True:
-            if self.mgr.wait_for_transaction(self.vmId, 30) == True:
+            with tracing.span('api SoftLayer_Virtual_Guest::wait_for_transaction'):
+                ready = self.mgr.wait_for_transaction(self.vmId, 30)
+            if ready == True:
                 print("Server with ID %s is ready" % self.vmId)
                 break
             else:
@@ -259,54 +319,71 @@ class VmOrderVerify(VmConnector):
         myOrder = VmOrderVerify('vm-demo','webapp')   # test creation without ordering 
         '''
 
-    def __init__(self,vmName,vmType):
+    def __init__(self,vmName,vmType, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.mgr = SoftLayer.VSManager(self.client)
         self.vmName = vmName
         self.vmType = vmType
 
-        self.webapp_vsi = {
-            'domain': 'nanigans.com',
-            'hostname': self.vmName,
-            'datacenter': 'dal10',
-            'dedicated': False,
-            'private': True,
-            'cpus': 1,
-            'os_code' : 'CentOS_6_64',
-            'hourly': True,
-            'ssh_keys': [1234],
-            'disks': ('100','25'),
-            'local_disk': True,
-            'memory': 4096,
-            'tags': 'demo VM'
-        }
-
-        self.minimal_vsi = {
-            'domain': 'nanigans.com',
-            'hostname': self.vmName,
-            'datacenter': 'dal10',
-            'dedicated': False,
-            'private': True,
-            'cpus': 1,
-            'os_code' : 'CentOS_6_64',
-            'hourly': True,
-            'ssh_keys': [1234],
-            'disks': ('100','25'),
-            'local_disk': True,
-            'memory': 1024,
-            'tags': 'Minimal VM for demo'
-        }
+        # Same configs VmOrder places
+        self.webapp_vsi = vsi_profile(vmName, 'webapp')
+        self.minimal_vsi = vsi_profile(vmName, 'minimal')
 
         if self.vmType == 'webapp':
+            self.account.reference.check_order(self.webapp_vsi)
             myVsi = self.mgr.verify_create_instance(**self.webapp_vsi)
         if self.vmType == 'minimal':
+            self.account.reference.check_order(self.minimal_vsi)
             myVsi = self.mgr.verify_create_instance(**self.minimal_vsi)
 
         print myVsi
 
 
 
+# VM configs VmOrder and VmOrderBatch can place, by vmType.
+# Future VM configs can go here
+VM_PROFILES = {
+    'webapp': {
+        'domain': 'nanigans.com',
+        'datacenter': 'dal10',
+        'dedicated': False,
+        'private': True,
+        'cpus': 1,
+        'os_code' : 'CentOS_6_64',
+        'hourly': True,
+        'ssh_keys': [1234],
+        'disks': ('100','25'),
+        'local_disk': True,
+        'memory': 4096,
+        'tags': 'Nanigans WebApp VM'
+    },
+    'minimal': {
+        'domain': 'nanigans.com',
+        'datacenter': 'dal10',
+        'dedicated': False,
+        'private': True,
+        'cpus': 1,
+        'os_code' : 'CentOS_6_64',
+        'hourly': True,
+        'ssh_keys': [1234],
+        'disks': ('100','25'),
+        'local_disk': True,
+        'memory': 1024,
+        'tags': 'Nanigans Minimal VM'
+    },
+}
+
+
+def vsi_profile(vmName, vmType):
+    ''' The create_instance arguments for hostname vmName using
+        the vmType config from VM_PROFILES '''
+
+    vsi = dict(VM_PROFILES[vmType])
+    vsi['hostname'] = vmName
+    return(vsi)
+
+
 class VmOrder(VmConnector):
     ''' class to handle ordering and creating vm's
 
@@ -315,54 +392,220 @@ class VmOrder(VmConnector):
         where: vm-demo is the hostname you want to set
                webapp is the VM config we want to use '''
 
-    def __init__(self,vmName,vmType):
+    def __init__(self,vmName,vmType, account=None):
 
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.mgr = SoftLayer.VSManager(self.client)
         self.vmName = vmName
         self.vmType = vmType
 
-        self.webapp_vsi = {
-            'domain': 'nanigans.com',
-            'hostname': vmName,
-            'datacenter': 'dal10',
-            'dedicated': False,
-            'private': True,
-            'cpus': 1,
-            'os_code' : 'CentOS_6_64',
-            'hourly': True,
-            'ssh_keys': [1234],
-            'disks': ('100','25'),
-            'local_disk': True,
-            'memory': 4096,
-            'tags': 'Nanigans WebApp VM'
-        }
-
-        self.minimal_vsi = {
-            'domain': 'nanigans.com',
-            'hostname': vmName,
-            'datacenter': 'dal10',
-            'dedicated': False,
-            'private': True,
-            'cpus': 1,
-            'os_code' : 'CentOS_6_64',
-            'hourly': True,
-            'ssh_keys': [1234],
-            'disks': ('100','25'),
-            'local_disk': True,
-            'memory': 1024,
-            'tags': 'Nanigans Minimal VM'
-        }
+        self.webapp_vsi = vsi_profile(vmName, 'webapp')
+        self.minimal_vsi = vsi_profile(vmName, 'minimal')
 
 
-        if self.vmType == 'webapp':
-            myVsi = self.mgr.create_instance(**self.webapp_vsi)
-        if self.vmType == 'minimal':
-            myVsi = self.mgr.create_instance(**self.minimal_vsi)
+        # Retries re-check for the hostname first so an order that went
+        # through before a timeout is not placed twice.
+        profiles = {'webapp': self.webapp_vsi, 'minimal': self.minimal_vsi}
+        self.account.reference.check_order(profiles[self.vmType])
+        myVsi = resilience.call('SoftLayer_Virtual_Guest::createObject',
+                                self.mgr.create_instance,
+                                kwargs=profiles[self.vmType],
+                                done=self._exists,
+                                account=self.account.name)
 
-        # Future VM configs can go here 
+        if myVsi is resilience.SKIPPED:
+            myVsi = self._exists()
+            print("%s already exists, not ordering" % vmName)
 
         print myVsi
+        self.vsi = myVsi
+
+
+    def _exists(self):
+        ''' The existing guest with our hostname, if any '''
+
+        for virtualGuest in self.client['SoftLayer_Account'].getVirtualGuests(
+                mask='mask[id,hostname,domain]',
+                filter={'virtualGuests': {'hostname': {'operation': self.vmName}}}):
+            if virtualGuest['hostname'] == self.vmName:
+                return virtualGuest
+
+        return None
+
+
+class VmOrderBatch(VmConnector):
+    ''' class to order many vm's at once and wait for all of them.
+
+        verify() checks every order concurrently with
+        verify_create_instance.  place() skips hostnames that already
+        exist and submits the rest chunkSize at a time.  wait() runs
+        one shared StatusFeed poller for the whole batch and hands
+        each guest to the post-provision hooks as soon as it is
+        ready, so the batch takes as long as its slowest VM.
+
+        Example:
+        myBatch = VmOrderBatch([('web01', 'webapp'), ('web02', 'webapp'),
+                                ('util01', 'minimal')])
+        myBatch.add_hook(lambda guest: pp(guest))  # e.g. run config mgmt
+        report = myBatch.run()      # Caution will result in a charge
+        '''
+
+    def __init__(self, orders, chunkSize=10, workers=8, account=None):
+
+        VmConnector.__init__(self, account)
+        self.orders = [vsi_profile(vmName, vmType) for vmName, vmType in orders]
+        self.chunkSize = chunkSize
+        self.workers = workers
+        self.hooks = []
+        self.placed = {}        # id -> hostname
+        self.notPlaced = []     # hostnames ordered but not found after
+        self.ready = {}         # hostname -> ready event
+        self.hookErrors = {}
+
+
+    def add_hook(self, hook):
+        ''' hook(guest) is called with each guest's status event
+            (id, hostname, powerState, provisionDate) once it is ready '''
+
+        self.hooks.append(hook)
+
+
+    def verify(self):
+        ''' Verify every order at once. Returns {hostname: error} for
+            the ones SL would reject; empty means all good. '''
+
+        def check(vsi):
+            try:
+                self.account.reference.check_order(vsi)
+                self.mgr.verify_create_instance(**vsi)
+            except (ValueError, SoftLayer.SoftLayerAPIError) as e:
+                return vsi['hostname'], str(e)
+            return vsi['hostname'], None
+
+        pool = ThreadPool(self.workers)
+        try:
+            results = pool.map(tracing.bind(check), self.orders)
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict((h, e) for h, e in results if e is not None)
+
+
+    def place(self):
+        ''' Submit the orders in chunks. Returns {id: hostname} of what
+            was ordered; hostnames already on the account are left out. '''
+
+        existing = set(g['hostname'] for g in self.get_virtual_guests())
+        todo = [vsi for vsi in self.orders if vsi['hostname'] not in existing]
+        for vsi in self.orders:
+            if vsi['hostname'] in existing:
+                print("%s already exists, not ordering" % vsi['hostname'])
+
+        for start in range(0, len(todo), self.chunkSize):
+            chunk = todo[start:start + self.chunkSize]
+            hostnames = tuple(vsi['hostname'] for vsi in chunk)
+            # A retry first checks whether the chunk went through before
+            # the error. Any of its hostnames showing up counts, so a
+            # partly placed chunk is never sent again.
+            created = resilience.call('SoftLayer_Virtual_Guest::createObjects',
+                                      self.mgr.create_instances, args=(chunk,),
+                                      done=lambda hostnames=hostnames: bool(self._existing(hostnames)),
+                                      account=self.account.name)
+            if created is resilience.SKIPPED:
+                created = self._existing(hostnames)
+                found = set(g['hostname'] for g in created)
+                for hostname in hostnames:
+                    if hostname not in found:
+                        self.notPlaced.append(hostname)
+                        print("%s was not found after its order, check the account" % hostname)
+            for guest in created:
+                self.placed[guest['id']] = guest['hostname']
+                print("Ordered %s id %s" % (guest['hostname'], guest['id']))
+
+        return(self.placed)
+
+
+    def _existing(self, hostnames):
+        ''' Guests on the account with one of hostnames '''
+
+        guests = self.client['SoftLayer_Account'].getVirtualGuests(
+            mask='mask[id,hostname]',
+            filter={'virtualGuests': {'hostname': {
+                'operation': 'in',
+                'options': [{'name': 'data', 'value': list(hostnames)}]}}})
+
+        return [g for g in guests if g['hostname'] in hostnames]
+
+
+    def wait(self, interval=30, timeout=None):
+        ''' Poll until every placed guest is provisioned, running hooks
+            on a worker pool as each one comes up. Returns the hostnames
+            still not ready if timeout (seconds) ran out. '''
+
+        pending = set(self.placed)
+        pool = ThreadPool(self.workers)
+
+        def run_hooks(event):
+            for hook in self.hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    self.hookErrors[event['hostname']] = '%s: %s' % (type(e).__name__, e)
+
+        def on_event(event):
+            if event['id'] not in pending or event['event'] == 'removed':
+                return
+            if event['provisionDate'] and not event['activeTransaction']:
+                pending.discard(event['id'])
+                self.ready[event['hostname']] = event
+                print("%s is ready" % event['hostname'])
+                pool.apply_async(tracing.bind(run_hooks), (event,))
+
+        feed = StatusFeed(client=self.client, interval=interval, callback=on_event,
+                          account=self.account)
+        started = time.time()
+        try:
+            while pending:
+                tick = time.time()
+                try:
+                    feed.poll()
+                except Exception as e:
+                    # A failed listing is not a failed order; try the next tick
+                    if resilience.classify(e) != 'transient':
+                        raise
+                    print("Status poll failed (%s), retrying" % e)
+                if not pending:
+                    break
+                if timeout is not None and time.time() - started > timeout:
+                    break
+                print("Waiting on %d of %d vm's" % (len(pending), len(self.placed)))
+                sys.stdout.flush()
+                time.sleep(max(0, interval - (time.time() - tick)))
+        finally:
+            pool.close()
+            pool.join()
+
+        return sorted(self.placed[id] for id in pending)
+
+
+    def run(self, interval=30, timeout=None):
+        ''' verify, place and wait. Nothing is ordered if any order
+            fails verification. The report's notPlaced lists hostnames
+            whose chunk was ordered but which never showed up. '''
+
+        errors = self.verify()
+        if errors:
+            for hostname, error in sorted(errors.items()):
+                print("%s failed verification: %s" % (hostname, error))
+            return {'verifyErrors': errors, 'placed': {}, 'notPlaced': [], 'ready': [],
+                    'notReady': [], 'hookErrors': {}}
+
+        self.place()
+        notReady = self.wait(interval=interval, timeout=timeout)
+        return {'verifyErrors': {}, 'placed': self.placed,
+                'notPlaced': sorted(self.notPlaced), 'ready': sorted(self.ready),
+                'notReady': notReady, 'hookErrors': self.hookErrors}
 
 
 class VmCancel(VmConnector):
@@ -374,8 +617,8 @@ class VmCancel(VmConnector):
         A ticket will be created at SL if no errors '''
 
 
-    def __init__(self):
-        VmConnector.__init__(self)
+    def __init__(self, account=None):
+        VmConnector.__init__(self, account)
         self.mgr = SoftLayer.VSManager(self.client)
 
 
@@ -385,7 +628,7 @@ class VmCancel(VmConnector):
 
         self.vmname = vmname
 
-        myVm = VmStatus(self.vmname)
+        myVm = VmStatus(self.vmname, account=self.account)
         myVmId = myVm.vm_status()
         print("The SL ID is %s" % myVmId)
         myVmId = int(myVmId)        
@@ -398,22 +641,131 @@ class VmReload(VmConnector):
 
     '''
 
-    def __init__(self,vmName):
+    def __init__(self,vmName, account=None):
 
         self.vmName = vmName
-        VmConnector.__init__(self)
+        VmConnector.__init__(self, account)
         self.mgr = SoftLayer.VSManager(self.client)
 
     def vmReload(self):
         ''' here we take the vmname, find the SL id
             and reload by id '''
 
-        myVm = VmStatus(self.vmName)
-        myVmId = myVm.vm_status() 
-        myVmId = int(myVmId)
-        vsi = self.mgr.reload_instance(myVmId)     
+        with tracing.span('vm.reload', hostname=self.vmName) as sp:
+
+            with tracing.span('lookup'):
+                myVm = VmStatus(self.vmName, account=self.account)
+                myVmId = myVm.vm_status() 
+                myVmId = int(myVmId)
+            sp.set('vm.id', myVmId)
+
+            with tracing.span('reload'):
+                vsi = self.mgr.reload_instance(myVmId)     
+
+            with tracing.span('monitor'):
+                myVm.vm_monitor(myVmId)
+
+
+class VmFleet(VmConnector):
+    ''' Class to run power, reload and cancel actions against every
+        VM matching a selector (see selector.py) with one lookup.
+
+    /* Example:
+    myFleet = VmFleet('tag=Nanigans WebApp VM, dc=dal10, power=halted')
+    pp(myFleet.guests())            # check what we matched first
+    myFleet.power_on()
+    myFleet.cancel(confirm=True)    # reload and cancel need confirm
+    */ '''
+
+    def __init__(self, selector, inventory=None, account=None):
+
+        VmConnector.__init__(self, account)
+        if not isinstance(selector, Selector):
+            selector = Selector(selector)
+        self.selector = selector
+        if inventory is not None:
+            inventory.check_account(self.account)
+        self.inventory = inventory
+        self.selected = None
+
+
+    def guests(self):
+        ''' Resolve the selector once. The inventory snapshot is used
+            when one was passed in. '''
+
+        if self.selected is None:
+            if self.inventory is not None:
+                self.selected = self.selector.select_inventory(self.inventory)
+            else:
+                self.selected = self.selector.select(self.client)
+
+        return(self.selected)
+
+
+    def _each(self, action, endpoint, fn, doneState=None):
+        ''' Run fn(id) for every selected guest through the resilience
+            layer. Guests already in doneState are skipped. '''
+
+        results = {}
+        for guest in self.guests():
+            done = None
+            if doneState is not None:
+                done = lambda id=guest.id: self.power_state(id) == doneState
+            try:
+                results[guest.hostname] = resilience.call(
+                    endpoint, fn, args=(guest.id,), done=done,
+                    key=(endpoint, guest.id) if doneState is None else None,
+                    account=self.account.name)
+                if results[guest.hostname] is resilience.SKIPPED:
+                    print("%s skipped, %s already done" % (guest.hostname, action))
+                else:
+                    print("%s %s" % (guest.hostname, action))
+            except (SoftLayer.SoftLayerAPIError, resilience.CircuitOpenError) as e:
+                results[guest.hostname] = e
+                print("Unable to %s %s" % (action, guest.hostname))
+
+        return(results)
+
+
+    def power_on(self):
+
+        return self._each('power on', 'SoftLayer_Virtual_Guest::powerOn',
+                          lambda id: self.client['SoftLayer_Virtual_Guest'].powerOn(id=id),
+                          doneState='RUNNING')
+
+
+    def power_off(self):
+
+        return self._each('power off', 'SoftLayer_Virtual_Guest::powerOff',
+                          lambda id: self.client['SoftLayer_Virtual_Guest'].powerOff(id=id),
+                          doneState='HALTED')
+
+
+    def reboot(self):
+
+        return self._each('reboot', 'SoftLayer_Virtual_Guest::rebootDefault',
+                          lambda id: self.client['SoftLayer_Virtual_Guest'].rebootDefault(id=id))
+
+
+    def _confirm(self, action, confirm):
+
+        if not confirm:
+            raise ValueError('Refusing to %s every guest matching %r without confirm=True'
+                             % (action, self.selector.text))
+
+
+    def reload(self, confirm=False):
+
+        self._confirm('reload', confirm)
+        return self._each('reload', 'SoftLayer_Virtual_Guest::reloadOperatingSystem',
+                          self.mgr.reload_instance)
+
+
+    def cancel(self, confirm=False):
 
-        myVm.vm_monitor(myVmId)
+        self._confirm('cancel', confirm)
+        return self._each('cancel', 'SoftLayer_Billing_Item::cancelService',
+                          self.mgr.cancel_instance)
 
 
 if __name__ == '__main__':